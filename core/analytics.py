@@ -0,0 +1,149 @@
+"""
+Sales totals over every completed order line, live and archived.
+
+Lines are streamed from the database a chunk at a time into NumPy columns
+and summed into arrays indexed by item id and by day, so memory depends on
+the catalog size and the date range, not on the number of lines.
+"""
+import numpy as np
+from django.db.models import CharField
+from django.db.models.functions import Cast, Substr
+from .catalog import LOOKUP_BATCH, chunked
+from .models import ArchivedOrderLine, CATEGORY_CHOICES, Item, Order
+
+OrderLine = Order.items.through
+
+# the columns every source yields: day, item id, quantity, price, discount
+# price
+LIVE_COLUMNS = ('day', 'orderitem__item_id', 'orderitem__quantity',
+                'orderitem__price', 'orderitem__discount_price')
+ARCHIVED_COLUMNS = ('day', 'item_id', 'quantity', 'price', 'discount_price')
+MEASURES = ('revenue', 'units', 'savings', 'lines')
+
+
+def item_values(ids, field):
+    """{item id: field} for the items among ids."""
+    values = {}
+    for chunk in chunked(ids, LOOKUP_BATCH):
+        values.update(Item.objects.filter(pk__in=chunk).values_list('pk', field))
+    return values
+
+
+def order_day():
+    # the UTC date as YYYY-MM-DD text: turning a million timestamps into
+    # aware datetimes costs far more than the rest of the report
+    return Substr(Cast('order__ordered_date', CharField()), 1, 10)
+
+
+def line_sources():
+    return [
+        OrderLine.objects.filter(order__ordered=True).annotate(
+            day=order_day()).values_list(*LIVE_COLUMNS),
+        ArchivedOrderLine.objects.annotate(day=order_day()).values_list(*ARCHIVED_COLUMNS),
+    ]
+
+
+class Totals:
+    """Sums of every measure for keys 0..n, grown as larger keys arrive."""
+
+    def __init__(self):
+        self.sums = {measure: np.zeros(0) for measure in MEASURES}
+
+    def add(self, keys, values):
+        if not len(keys):
+            return
+        size = int(keys.max()) + 1
+        for measure, sums in self.sums.items():
+            if len(sums) < size:
+                sums = self.sums[measure] = np.concatenate([sums, np.zeros(size - len(sums))])
+            sums[:size] += np.bincount(keys, weights=values[measure], minlength=size)
+
+    def shift(self, size):
+        # room for size keys below the current first one
+        for measure, sums in self.sums.items():
+            self.sums[measure] = np.concatenate([np.zeros(size), sums])
+
+    def nonzero(self):
+        return np.flatnonzero(self.sums['lines']).tolist()
+
+
+class SalesReport:
+    def __init__(self, chunk_size=50000):
+        self.chunk_size = chunk_size
+        self.lines = 0
+        self.first_day = None
+        self.by_item = Totals()
+        self.by_day = Totals()
+
+    def run(self, sources=None):
+        for lines in sources or line_sources():
+            for chunk in chunked(lines.iterator(chunk_size=self.chunk_size), self.chunk_size):
+                self.add(chunk)
+        return self
+
+    def add(self, rows):
+        days, item_ids, quantities, prices, discount_prices = zip(*rows)
+        count = len(rows)
+        days = np.array(days, dtype='datetime64[D]').astype(np.int64)
+        # lines whose item was deleted from the catalog are kept under 0
+        item_ids = np.array([item_id or 0 for item_id in item_ids], dtype=np.int64)
+        quantities = np.array(quantities, dtype=float)
+        prices = np.array(prices, dtype=float)
+        discount_prices = np.array(discount_prices, dtype=float)
+
+        # OrderItem.get_final_price(): the discount price whenever one is set
+        on_sale = ~np.isnan(discount_prices) & (discount_prices != 0)
+        total_prices = quantities * prices
+        final_prices = np.where(on_sale, quantities * discount_prices, total_prices)
+        values = {
+            'revenue': final_prices,
+            'units': quantities,
+            'savings': np.where(on_sale, total_prices - final_prices, 0),
+            'lines': np.ones(count),
+        }
+        if self.first_day is None:
+            self.first_day = int(days.min())
+        if days.min() < self.first_day:
+            self.by_day.shift(self.first_day - int(days.min()))
+            self.first_day = int(days.min())
+        self.by_item.add(item_ids, values)
+        self.by_day.add(days - self.first_day, values)
+        self.lines += count
+
+    def rows(self, by):
+        """(key columns, rows) of the totals grouped by category, item or day."""
+        return getattr(self, f'{by}_rows')()
+
+    def item_rows(self):
+        ids = self.by_item.nonzero()
+        items = item_values(ids, 'slug')
+        return ['item_id', 'slug'], [
+            [item_id, items.get(item_id, '')] + self.measures(self.by_item, item_id)
+            for item_id in ids]
+
+    def category_rows(self):
+        ids = self.by_item.nonzero()
+        codes = {category: n for n, (category, _) in enumerate(CATEGORY_CHOICES)}
+        categories = item_values(ids, 'category')
+        # items deleted since, or with an unknown category, are counted last
+        other = len(CATEGORY_CHOICES)
+        groups = np.array([codes.get(categories.get(item_id), other) for item_id in ids],
+                          dtype=np.int64)
+        by_category = Totals()
+        by_category.add(groups, {measure: self.by_item.sums[measure][ids]
+                                 for measure in MEASURES})
+        names = [category for category, _ in CATEGORY_CHOICES] + ['']
+        return ['category'], [[names[code]] + self.measures(by_category, code)
+                              for code in by_category.nonzero()]
+
+    def day_rows(self):
+        return ['day'], [
+            [str(np.datetime64(self.first_day + offset, 'D'))] +
+            self.measures(self.by_day, offset)
+            for offset in self.by_day.nonzero()]
+
+    def measures(self, totals, key):
+        return [round(float(totals.sums['revenue'][key]), 2),
+                int(totals.sums['units'][key]),
+                round(float(totals.sums['savings'][key]), 2),
+                int(totals.sums['lines'][key])]
@@ -0,0 +1,137 @@
+"""
+Moves completed orders out of Order and OrderItem into ArchivedOrder and
+ArchivedOrderLine, and reads a user's order history from both.
+
+Every batch is archived and deleted in its own transaction, so an
+interrupted run leaves each order either live or archived and the next run
+carries on with what is left.
+"""
+from datetime import timedelta
+from django.db import connection, transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+from .catalog import LOOKUP_BATCH, chunked
+from .models import ArchivedOrder, ArchivedOrderLine, Order, OrderItem
+
+OrderLine = Order.items.through
+
+
+def delete_rows(model, column, ids, orphans_only=False):
+    """
+    Deletes the rows of model whose column is among ids with a raw DELETE
+    per LOOKUP_BATCH ids; with orphans_only, only OrderItem rows that are
+    in no order. Sends no signals and follows no relations.
+    """
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    sql = 'DELETE FROM {table} WHERE {column} IN ({ids})'
+    if orphans_only:
+        sql += ' AND NOT EXISTS (SELECT 1 FROM {lines} WHERE {lines}.{orderitem} = {table}.{pk})'
+    with connection.cursor() as cursor:
+        for chunk in chunked(ids, LOOKUP_BATCH):
+            cursor.execute(sql.format(
+                table=table, column=quote(column), ids=', '.join(['%s'] * len(chunk)),
+                pk=quote(model._meta.pk.column),
+                lines=quote(OrderLine._meta.db_table),
+                orderitem=quote(OrderLine._meta.get_field('orderitem').column),
+            ), chunk)
+
+
+def archivable_orders(days):
+    cutoff = timezone.now() - timedelta(days=days)
+    return Order.objects.filter(ordered=True, ordered_date__lt=cutoff)
+
+
+def archive_batch(orders, batch_size, after=0):
+    """
+    Archives the next batch_size orders of the queryset with an id above
+    `after`. Returns (orders archived, lines archived, last id).
+    """
+    with transaction.atomic():
+        batch = list(orders.select_for_update().filter(pk__gt=after).order_by('pk')[:batch_size])
+        if not batch:
+            return 0, 0, after
+        lines = list(OrderLine.objects.filter(order__in=batch).values_list(
+            'order_id', 'orderitem_id', 'orderitem__quantity', 'orderitem__item_id',
+            'orderitem__item__title', 'orderitem__price', 'orderitem__discount_price'))
+        ArchivedOrder.objects.bulk_create([
+            ArchivedOrder(id=order.pk, user_id=order.user_id, start_date=order.start_date,
+                          ordered_date=order.ordered_date,
+                          billing_address_id=order.billing_address_id,
+                          total=order.total, item_count=order.item_count)
+            for order in batch
+        ])
+        ArchivedOrderLine.objects.bulk_create([
+            ArchivedOrderLine(order_id=order_id, item_id=item_id, title=title,
+                              quantity=quantity, price=price, discount_price=discount_price)
+            for order_id, _, quantity, item_id, title, price, discount_price in lines
+        ])
+        # The rows move to the archive rather than go away, so the delete
+        # signals are skipped: OrderItem's receivers recompute the totals
+        # of the orders a line is in and Order's clears its user's cart
+        # count, and neither applies to a completed order. Sending them
+        # would cost a query or more per row.
+        order_ids = [order.pk for order in batch]
+        delete_rows(OrderLine, OrderLine._meta.get_field('order').column, order_ids)
+        # lines that no other order refers to go with their orders
+        delete_rows(OrderItem, OrderItem._meta.pk.column,
+                    list({line[1] for line in lines}), orphans_only=True)
+        delete_rows(Order, Order._meta.pk.column, order_ids)
+    return len(batch), len(lines), batch[-1].pk
+
+
+def archive_orders(days, batch_size=500, max_batches=None, progress=None):
+    """
+    Archives the orders completed more than `days` days ago, batch_size at
+    a time, stopping after max_batches. Returns (orders, lines) archived.
+    """
+    orders = archivable_orders(days)
+    archived = archived_lines = batches = last = 0
+    while max_batches is None or batches < max_batches:
+        count, lines, last = archive_batch(orders, batch_size, last)
+        if not count:
+            break
+        archived += count
+        archived_lines += lines
+        batches += 1
+        if progress:
+            progress(archived, archived_lines)
+    return archived, archived_lines
+
+
+def order_history(user):
+    """
+    The user's completed orders, live and archived, newest first, as dicts
+    of the order and its lines. Four queries whatever the history size.
+    """
+    live = Order.objects.filter(user=user, ordered=True).prefetch_related(
+        Prefetch('items', queryset=OrderItem.objects.select_related(
+            'item').with_line_totals().order_by('pk')))
+    archived = ArchivedOrder.objects.filter(user=user).prefetch_related(
+        Prefetch('lines', queryset=ArchivedOrderLine.objects.select_related(
+            'item').order_by('pk')))
+    history = [
+        history_entry(order, False, [
+            (line.item.title, line.item.slug, line.quantity, line.line_final_price)
+            for line in order.items.all()])
+        for order in live
+    ] + [
+        history_entry(order, True, [
+            (line.title, line.item and line.item.slug, line.quantity, line.get_final_price())
+            for line in order.lines.all()])
+        for order in archived
+    ]
+    history.sort(key=lambda entry: (entry['ordered_date'], entry['id']), reverse=True)
+    return history
+
+
+def history_entry(order, archived, lines):
+    return {
+        'id': order.pk,
+        'ordered_date': order.ordered_date,
+        'total': order.total,
+        'item_count': order.item_count,
+        'archived': archived,
+        'lines': [{'title': title, 'slug': slug, 'quantity': quantity, 'final_price': price}
+                  for title, slug, quantity, price in lines],
+    }
@@ -0,0 +1,11 @@
+from django.contrib.staticfiles.storage import ManifestFilesMixin
+from storages.backends.azure_storage import AzureStorage
+from .storage import StaticPipelineMixin
+
+
+class AzureManifestStaticStorage(StaticPipelineMixin, ManifestFilesMixin, AzureStorage):
+    """
+    Hashed and minified static files in Azure blob storage. Blob storage
+    can't choose a variant by Accept-Encoding, so none are uploaded.
+    """
+    compress = False
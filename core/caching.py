@@ -0,0 +1,78 @@
+import hashlib
+import uuid
+from django.core.cache import cache
+from .models import Order
+
+CART_COUNT_TIMEOUT = 60 * 60 * 24
+PRODUCT_PAGE_TIMEOUT = 60 * 60 * 24
+ITEM_CARD_TIMEOUT = 60 * 60 * 24
+# what a catalog card shows
+ITEM_CARD_FIELDS = ('slug', 'title', 'category', 'label', 'price', 'discount_price')
+
+
+def cart_count_key(user_id):
+    return f'cart-count:{user_id}'
+
+
+def get_cart_count(user):
+    """Number of lines in the user's open cart, read from the cache when possible."""
+    key = cart_count_key(user.pk)
+    count = cache.get(key)
+    if count is None:
+        count = Order.objects.filter(user=user, ordered=False).values_list(
+            'item_count', flat=True).first() or 0
+        cache.set(key, count, CART_COUNT_TIMEOUT)
+    return count
+
+
+def set_cart_count(user_id, count):
+    cache.set(cart_count_key(user_id), count, CART_COUNT_TIMEOUT)
+
+
+def clear_cart_count(user_id):
+    cache.delete(cart_count_key(user_id))
+
+
+def clear_cart_counts(user_ids):
+    cache.delete_many([cart_count_key(user_id) for user_id in user_ids])
+
+
+# Product pages are cached under a version that changes whenever the item
+# does, once the change is committed. The version is read before the row,
+# so a page rendered from a row read before the commit is stored under the
+# version it replaced.
+
+def product_version_key(slug):
+    return f'product-version:{slug}'
+
+
+def product_page_key(slug, version):
+    return f'product-page:{slug}:{version}'
+
+
+def get_product_version(slug):
+    # an item never changed since the cache was emptied is at version 0.
+    # Nothing is written here, so requests for slugs that don't exist leave
+    # no keys behind: versions only come from changes to items.
+    return cache.get(product_version_key(slug), '0')
+
+
+def get_product_versions(slugs):
+    """get_product_version() for many items in a single cache call."""
+    versions = cache.get_many([product_version_key(slug) for slug in slugs])
+    return [versions.get(product_version_key(slug), '0') for slug in slugs]
+
+
+def bump_product_versions(slugs):
+    """Gives the items new versions, in a single cache call."""
+    cache.set_many({product_version_key(slug): uuid.uuid4().hex for slug in slugs}, None)
+
+
+# Catalog cards are cached under a hash of the fields they show, so a card
+# rendered from the row the page just read is always current: saving the
+# item, the catalog importer and queryset updates all change the key,
+# without anything to invalidate. Outdated cards expire on their own.
+
+def item_card_key(item):
+    fields = repr(tuple(getattr(item, name) for name in ITEM_CARD_FIELDS))
+    return f'item-card:{item.pk}:{hashlib.md5(fields.encode()).hexdigest()}'
@@ -0,0 +1,239 @@
+import json
+from collections import namedtuple
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Item, OrderItem, Order, item_prices
+
+# outcomes of a cart change
+ADDED, UPDATED, REMOVED, NOT_IN_CART, NO_ORDER = (
+    'added', 'updated', 'removed', 'not-in-cart', 'no-order')
+
+CartChange = namedtuple('CartChange', ['order', 'status'])
+
+OrderLine = Order.items.through
+
+
+def get_cart(user, create=False):
+    """
+    The user's open order, locked for the rest of the transaction so
+    concurrent changes to the same cart are applied one after another.
+    """
+    order = Order.objects.select_for_update().filter(user=user, ordered=False).first()
+    if order is None and create:
+        try:
+            with transaction.atomic():
+                order = Order.objects.create(user=user, ordered_date=timezone.now())
+        except IntegrityError:
+            # another request opened the cart first
+            order = Order.objects.select_for_update().get(user=user, ordered=False)
+    return order
+
+
+def add_item(user, item_id):
+    with transaction.atomic():
+        order = get_cart(user, create=True)
+        if OrderItem.objects.filter(order=order, item_id=item_id).update(
+                quantity=F('quantity') + 1):
+            status = UPDATED
+        else:
+            status = attach_item(order, user, item_id)
+        order.update_totals()
+    return CartChange(order, status)
+
+
+def attach_item(order, user, item_id):
+    try:
+        with transaction.atomic():
+            order_item = OrderItem.objects.create(user=user, item_id=item_id,
+                                                  **item_prices(item_id))
+    except IntegrityError:
+        # the user's open line for this item already exists: either another
+        # request added it first, or it was removed from the cart earlier
+        order_item = OrderItem.objects.get(user=user, item_id=item_id, ordered=False)
+        if OrderLine.objects.filter(order=order, orderitem=order_item).exists():
+            OrderItem.objects.filter(pk=order_item.pk).update(quantity=F('quantity') + 1)
+            return UPDATED
+        if order_item.order_set.filter(ordered=True).exists():
+            # the line of an order placed without freezing its lines (the
+            # ordered box ticked in the admin): it keeps its quantity and
+            # prices, and the cart gets a line of its own
+            OrderItem.objects.filter(pk=order_item.pk).update(ordered=True)
+            order_item = OrderItem.objects.create(user=user, item_id=item_id,
+                                                  **item_prices(item_id))
+        else:
+            OrderItem.objects.filter(pk=order_item.pk).update(
+                quantity=1, **item_prices(item_id))
+    OrderLine.objects.create(order=order, orderitem=order_item)
+    return ADDED
+
+
+def remove_item(user, item_id):
+    with transaction.atomic():
+        order = get_cart(user)
+        if order is None:
+            return CartChange(None, NO_ORDER)
+        removed, _ = OrderLine.objects.filter(
+            order=order, orderitem__item_id=item_id).delete()
+        if not removed:
+            return CartChange(order, NOT_IN_CART)
+        order.update_totals()
+    return CartChange(order, REMOVED)
+
+
+def remove_single_item(user, item_id):
+    with transaction.atomic():
+        order = get_cart(user)
+        if order is None:
+            return CartChange(None, NO_ORDER)
+        if OrderItem.objects.filter(order=order, item_id=item_id, quantity__gt=1).update(
+                quantity=F('quantity') - 1):
+            status = UPDATED
+        elif OrderLine.objects.filter(order=order, orderitem__item_id=item_id).delete()[0]:
+            status = REMOVED
+        else:
+            return CartChange(order, NOT_IN_CART)
+        order.update_totals()
+    return CartChange(order, status)
+
+
+class UserCart:
+    """
+    The cart functions above bound to a logged in user, so views can treat
+    it and a CookieCart alike.
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    def add_item(self, item_id):
+        return add_item(self.user, item_id)
+
+    def remove_item(self, item_id):
+        return remove_item(self.user, item_id)
+
+    def remove_single_item(self, item_id):
+        return remove_single_item(self.user, item_id)
+
+
+def merge_items(user, quantities):
+    """
+    Add {item_id: quantity} to the user's cart in bulk, e.g. the cart an
+    anonymous visitor built before logging in.
+    """
+    prices = {pk: (price, discount_price) for pk, price, discount_price in
+              Item.objects.filter(pk__in=quantities).values_list('pk', 'price', 'discount_price')}
+    item_ids = set(prices)
+    if not item_ids:
+        return None
+    with transaction.atomic():
+        order = get_cart(user, create=True)
+        existing = {order_item.item_id: order_item for order_item in OrderItem.objects.filter(
+            user=user, item_id__in=item_ids, ordered=False)}
+        in_cart = set(OrderLine.objects.filter(order=order, orderitem__in=existing.values())
+                      .values_list('orderitem_id', flat=True))
+        for item_id, order_item in existing.items():
+            if order_item.pk in in_cart:
+                order_item.quantity += quantities[item_id]
+            else:
+                order_item.quantity = quantities[item_id]
+            order_item.price, order_item.discount_price = prices[item_id]
+        OrderItem.objects.bulk_update(existing.values(), ['quantity', 'price', 'discount_price'])
+        OrderItem.objects.bulk_create([
+            OrderItem(user=user, item_id=item_id, quantity=quantities[item_id],
+                      price=prices[item_id][0], discount_price=prices[item_id][1])
+            for item_id in item_ids - set(existing)
+        ])
+        attach = OrderItem.objects.filter(user=user, item_id__in=item_ids, ordered=False).exclude(
+            pk__in=in_cart).values_list('pk', flat=True)
+        OrderLine.objects.bulk_create([
+            OrderLine(order=order, orderitem_id=orderitem_id) for orderitem_id in attach])
+        order.update_totals()
+    return order
+
+
+class CookieCart:
+    """
+    The cart of an anonymous visitor: {item_id: quantity}, kept in a signed
+    cookie by CookieCartMiddleware so browsing never writes to the database.
+    It is merged into a real Order once the visitor logs in.
+    """
+    max_lines = 50
+
+    def __init__(self, quantities=None):
+        self.quantities = quantities or {}
+        self.modified = False
+
+    @classmethod
+    def loads(cls, value):
+        try:
+            data = json.loads(value) if value else {}
+            quantities = {int(item_id): int(quantity) for item_id, quantity in data.items()}
+        except (ValueError, TypeError, AttributeError):
+            return cls()
+        return cls({item_id: quantity for item_id, quantity in quantities.items()
+                    if quantity > 0})
+
+    def dumps(self):
+        return json.dumps(self.quantities, separators=(',', ':'))
+
+    def __len__(self):
+        return len(self.quantities)
+
+    def clear(self):
+        self.quantities = {}
+        self.modified = True
+
+    def add_item(self, item_id):
+        if item_id in self.quantities:
+            status = UPDATED
+        elif len(self.quantities) >= self.max_lines:
+            return CartChange(None, NOT_IN_CART)
+        else:
+            status = ADDED
+        self.quantities[item_id] = self.quantities.get(item_id, 0) + 1
+        self.modified = True
+        return CartChange(None, status)
+
+    def remove_item(self, item_id):
+        if not self.quantities:
+            return CartChange(None, NO_ORDER)
+        if self.quantities.pop(item_id, None) is None:
+            return CartChange(None, NOT_IN_CART)
+        self.modified = True
+        return CartChange(None, REMOVED)
+
+    def remove_single_item(self, item_id):
+        quantity = self.quantities.get(item_id)
+        if quantity is None:
+            return CartChange(None, NOT_IN_CART if self.quantities else NO_ORDER)
+        if quantity > 1:
+            self.quantities[item_id] = quantity - 1
+            status = UPDATED
+        else:
+            del self.quantities[item_id]
+            status = REMOVED
+        self.modified = True
+        return CartChange(None, status)
+
+    def snapshot(self):
+        """
+        An unsaved Order and its unsaved lines, carrying the same totals and
+        line_* values as Order.objects.active_cart_for().
+        """
+        items = Item.objects.in_bulk(list(self.quantities))
+        order_items = []
+        for item_id, quantity in self.quantities.items():
+            if item_id not in items:
+                continue
+            item = items[item_id]
+            order_item = OrderItem(item=item, quantity=quantity, price=item.price,
+                                   discount_price=item.discount_price)
+            order_item.line_total_price = order_item.get_item_total_price()
+            order_item.line_final_price = order_item.get_final_price()
+            order_item.line_amount_saved = (
+                order_item.line_total_price - order_item.line_final_price)
+            order_items.append(order_item)
+        order = Order(total=sum(order_item.line_final_price for order_item in order_items),
+                      item_count=len(order_items))
+        return order, order_items
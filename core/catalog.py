@@ -0,0 +1,232 @@
+"""
+Bulk loading of the catalog from CSV or JSON lines files.
+
+Rows are read lazily and saved a batch at a time, so memory use does not
+grow with the size of the file. Each batch costs a handful of queries:
+the slug lookups, one bulk INSERT for new items and one bulk UPDATE for
+items whose slug already exists.
+"""
+import csv
+import itertools
+import json
+import random
+from collections import Counter
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils.text import slugify
+from .caching import bump_product_versions
+from .facets import rebuild_facet_index
+from .models import CATEGORY_CHOICES, LABEL_CHOICES, Item, Order, OrderItem
+from .search import get_search_backend
+
+ITEM_FIELDS = ['title', 'price', 'discount_price', 'description', 'category', 'label']
+CATEGORIES = {value for value, name in CATEGORY_CHOICES}
+LABELS = {value for value, name in LABEL_CHOICES}
+
+# stays under SQLite's default limit of 999 bound parameters
+LOOKUP_BATCH = 900
+# leaves room for a "-<n>" suffix in the 50 character slug column
+SLUG_BASE_LENGTH = 40
+
+SYLLABLES = 'ba ko ri tu ne sa mo li ve da pu xi zo fe gar lun tor wes'.split()
+# a catalog-sized vocabulary, so terms are about as selective as real ones
+WORDS = [a + b + c for a in SYLLABLES for b in SYLLABLES for c in SYLLABLES]
+
+
+class RowError(ValueError):
+    pass
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def read_rows(stream, format):
+    """Yields (line number, row) for a CSV or JSON lines stream."""
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_num, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_num, json.loads(line)
+        except ValueError as e:
+            yield line_num, RowError(f'invalid JSON: {e}')
+
+
+def synthetic_rows(count, seed=0):
+    """Yields (number, row) for a made up catalog, for demos and benchmarks."""
+    rng = random.Random(seed)
+    categories = sorted(CATEGORIES)
+    labels = sorted(LABELS)
+    for n in range(1, count + 1):
+        price = round(rng.uniform(5, 200), 2)
+        yield n, {
+            'title': ' '.join(rng.sample(WORDS, 3)).title(),
+            'price': price,
+            'discount_price': round(price * 0.8, 2) if rng.random() < 0.25 else None,
+            'description': ' '.join(rng.choices(WORDS, k=30)),
+            'category': rng.choice(categories),
+            'label': rng.choice(labels),
+            'slug': f'sample-{n}',
+        }
+
+
+def parse_price(value, field, required=False):
+    if value in (None, ''):
+        if required:
+            raise RowError(f'{field} is required')
+        return None
+    try:
+        price = float(value)
+    except (TypeError, ValueError):
+        raise RowError(f'{field} is not a number: {value!r}')
+    if price < 0:
+        raise RowError(f'{field} is negative')
+    return price
+
+
+def clean_row(row):
+    """An unsaved Item for a raw row, or RowError if the row is invalid."""
+    if isinstance(row, RowError):
+        raise row
+    if not isinstance(row, dict):
+        raise RowError('row is not an object')
+    title = str(row.get('title') or '').strip()
+    if not title or len(title) > 100:
+        raise RowError('title is required and at most 100 characters')
+    price = parse_price(row.get('price'), 'price', required=True)
+    discount_price = parse_price(row.get('discount_price'), 'discount_price')
+    if discount_price is not None and discount_price > price:
+        raise RowError('discount_price is higher than price')
+    category = str(row.get('category') or '').strip().lower()
+    if category not in CATEGORIES:
+        raise RowError(f'unknown category: {category!r}')
+    label = str(row.get('label') or '').strip().upper()
+    if label not in LABELS:
+        raise RowError(f'unknown label: {label!r}')
+    slug = slugify(str(row.get('slug') or ''))
+    if len(slug) > 50:
+        raise RowError('slug is longer than 50 characters')
+    return Item(title=title, price=price, discount_price=discount_price,
+                description=str(row.get('description') or ''),
+                category=category, label=label, slug=slug or None)
+
+
+def allocate_slugs(items):
+    """
+    Gives every item without a slug a unique one the way Item.unique_slug()
+    does, but looking up the taken slugs for the whole batch at once
+    instead of one query per candidate.
+    """
+    pending = [(item, slugify(item.title)[:SLUG_BASE_LENGTH].strip('-') or 'item')
+               for item in items if not item.slug]
+    if not pending:
+        return
+    bases = Counter(base for item, base in pending)
+    taken = {item.slug for item in items if item.slug}
+    for chunk in chunked(bases, LOOKUP_BATCH):
+        taken.update(Item.objects.filter(slug__in=chunk).values_list('slug', flat=True))
+    # bases that need a suffix: look up the suffixes already in use
+    crowded = [base for base, count in bases.items() if count > 1 or base in taken]
+    for chunk in chunked(crowded, 100):
+        query = Q()
+        for base in chunk:
+            query |= Q(slug__startswith=f'{base}-')
+        taken.update(Item.objects.filter(query).values_list('slug', flat=True))
+    next_suffix = {}
+    for item, base in pending:
+        slug, n = base, next_suffix.get(base, 1)
+        while slug in taken:
+            n += 1
+            slug = f'{base}-{n}'
+        next_suffix[base] = n
+        taken.add(slug)
+        item.slug = slug
+
+
+def refresh_open_orders(item_ids):
+    """
+    What Item's post_save receiver does for a single item, after a queryset
+    update of many: the open carts holding them get the current prices and
+    totals.
+    """
+    for chunk in chunked(item_ids, LOOKUP_BATCH):
+        OrderItem.objects.filter(item__in=chunk, order__ordered=False).snapshot_prices()
+        Order.objects.filter(ordered=False, items__item__in=chunk).update_totals()
+
+
+class CatalogImporter:
+    """
+    Saves rows to the catalog a batch at a time. A row whose slug already
+    exists updates that item, any other row adds a new one.
+    """
+    max_errors = 20
+
+    def __init__(self, batch_size=1000, progress=None):
+        self.batch_size = batch_size
+        self.progress = progress
+        self.rows = self.created = self.updated = self.invalid = 0
+        self.errors = []
+
+    def run(self, rows):
+        """rows are (line number, row) pairs, as from read_rows()."""
+        for batch in chunked(rows, self.batch_size):
+            items = []
+            for line_num, row in batch:
+                try:
+                    items.append(clean_row(row))
+                except RowError as e:
+                    self.invalid += 1
+                    if len(self.errors) < self.max_errors:
+                        self.errors.append((line_num, str(e)))
+            self.save(items)
+            self.rows += len(batch)
+            if self.progress:
+                self.progress(self)
+        # bulk_create() skips the post_save indexing, so index the lot at once
+        get_search_backend().rebuild()
+        rebuild_facet_index()
+
+    def save(self, items):
+        with transaction.atomic():
+            # a slug repeated within the batch: the last row wins
+            by_slug = {item.slug: item for item in items if item.slug}
+            new = [item for item in items if not item.slug]
+            updates = []
+            for chunk in chunked(list(by_slug), LOOKUP_BATCH):
+                for slug, pk in Item.objects.filter(slug__in=chunk).values_list('slug', 'pk'):
+                    item = by_slug.pop(slug)
+                    item.pk = pk
+                    updates.append(item)
+            new.extend(by_slug.values())
+            allocate_slugs(new)
+            Item.objects.bulk_create(new)
+            if updates:
+                self.update(updates)
+                refresh_open_orders([item.pk for item in updates])
+                slugs = [item.slug for item in updates]
+                transaction.on_commit(lambda: bump_product_versions(slugs))
+        self.created += len(new)
+        self.updated += len(updates)
+
+    def update(self, items):
+        # one prepared UPDATE run for every row: bulk_update()'s CASE WHEN
+        # statements slow down quadratically with the batch size
+        quote = connection.ops.quote_name
+        sql = 'UPDATE %s SET %s WHERE %s = %%s' % (
+            quote(Item._meta.db_table),
+            ', '.join('%s = %%s' % quote(Item._meta.get_field(name).column)
+                      for name in ITEM_FIELDS),
+            quote(Item._meta.pk.column))
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, [
+                [getattr(item, name) for name in ITEM_FIELDS] + [item.pk] for item in items])
@@ -0,0 +1,216 @@
+"""
+Catalog filtering by category, label, price range and sale, with the
+number of items behind every choice.
+
+The facet index keeps, for every facet value, a bitset of the ids of the
+items that have it (a Python int, bit n standing for item n). A filter is
+the AND across facets of the OR of the chosen values, and the count shown
+next to a value is the size of its bitset ANDed with the filter on the
+other facets. The index lives in the cache and follows Item saves and
+deletes one item at a time; it is rebuilt from a single query when it is
+missing, after a catalog import and every FACET_INDEX_TIMEOUT.
+"""
+import time
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Q, When
+from django.http import Http404
+from .models import CATEGORY_CHOICES, LABEL_CHOICES, Item
+from .pagination import NEXT, PREVIOUS, KeysetPage, decode_cursor, encode_cursor
+
+FACET_INDEX_KEY = 'facet-index'
+FACET_INDEX_LOCK = 'facet-index-lock'
+# bounds how long changes the index can't see (queryset updates) show in
+# the counts; the listed items are always checked against the database
+FACET_INDEX_TIMEOUT = 60 * 60
+# (value, label, lowest price, price below)
+PRICE_RANGES = (
+    ('0-25', 'Under $25', None, 25),
+    ('25-50', '$25 to $50', 25, 50),
+    ('50-100', '$50 to $100', 50, 100),
+    ('100-', '$100 and up', 100, None),
+)
+FACETS = {
+    'category': [(value, label) for value, label in CATEGORY_CHOICES],
+    'label': [(value, label) for value, label in LABEL_CHOICES],
+    'price': [(value, label) for value, label, low, high in PRICE_RANGES],
+    'sale': [('1', 'On sale')],
+}
+FACET_FIELDS = ('pk', 'category', 'label', 'price', 'discount_price')
+
+
+def item_facets(category, label, price, discount_price):
+    """The (facet, value) pairs of an item."""
+    values = [('category', category), ('label', label)]
+    # the price the customer pays, as on the catalog card
+    final_price = discount_price or price
+    for value, _, low, high in PRICE_RANGES:
+        if (low is None or final_price >= low) and (high is None or final_price < high):
+            values.append(('price', value))
+    if discount_price:
+        values.append(('sale', '1'))
+    return values
+
+
+def filter_items(queryset, selected):
+    """Filters an Item queryset by a selection, in SQL."""
+    on_sale = Q(discount_price__isnull=False) & ~Q(discount_price=0)
+    queryset = queryset.annotate(final_price=Case(
+        When(on_sale, then=F('discount_price')), default=F('price'), output_field=FloatField()))
+    for facet, values in selected.items():
+        if facet == 'sale':
+            queryset = queryset.filter(on_sale)
+        elif facet == 'price':
+            ranges = Q()
+            for value, _, low, high in PRICE_RANGES:
+                if value in values:
+                    price_range = Q()
+                    if low is not None:
+                        price_range &= Q(final_price__gte=low)
+                    if high is not None:
+                        price_range &= Q(final_price__lt=high)
+                    ranges |= price_range
+            queryset = queryset.filter(ranges)
+        else:
+            queryset = queryset.filter(**{f'{facet}__in': values})
+    return queryset
+
+
+try:
+    popcount = int.bit_count
+except AttributeError:
+    # before Python 3.10
+    def popcount(bits):
+        return bin(bits).count('1')
+
+
+class FacetIndex:
+    def __init__(self):
+        self.all = 0
+        self.bits = {(facet, value): 0 for facet, choices in FACETS.items()
+                     for value, _ in choices}
+
+    @classmethod
+    def build(cls, chunk_size=5000):
+        index = cls()
+        rows = Item.objects.order_by().values_list(*FACET_FIELDS)
+        for pk, *fields in rows.iterator(chunk_size=chunk_size):
+            index.add(pk, item_facets(*fields))
+        return index
+
+    def add(self, item_id, values):
+        bit = 1 << item_id
+        self.all |= bit
+        for key in values:
+            self.bits[key] |= bit
+
+    def remove(self, item_id):
+        mask = ~(1 << item_id)
+        self.all &= mask
+        for key in self.bits:
+            self.bits[key] &= mask
+
+    def match(self, selected, exclude=None):
+        """Bitset of the items matching selected, ignoring facet exclude."""
+        bits = self.all
+        for facet, values in selected.items():
+            if facet == exclude:
+                continue
+            either = 0
+            for value in values:
+                either |= self.bits.get((facet, value), 0)
+            bits &= either
+        return bits
+
+    def counts(self, selected):
+        """{facet: [(value, label, count, chosen)]} for a selection."""
+        counts = {}
+        for facet, choices in FACETS.items():
+            others = self.match(selected, exclude=facet)
+            chosen = selected.get(facet, ())
+            counts[facet] = [(value, label, popcount(self.bits[facet, value] & others),
+                              value in chosen) for value, label in choices]
+        return counts
+
+    def page(self, bits, per_page, cursor=None):
+        """
+        The ids of a page of the items in bits, in id order, with keyset
+        cursors like KeysetPaginator's.
+        """
+        direction, number, values = decode_cursor(cursor) if cursor else (NEXT, 1, None)
+        if values is not None:
+            if len(values) != 1 or not isinstance(values[0], int) or values[0] < 0:
+                raise Http404('Invalid cursor')
+            # an id past the last item makes no difference, but a huge one
+            # would build a huge int
+            values = [min(values[0], bits.bit_length())]
+        backwards = direction == PREVIOUS and values is not None
+        ids = []
+        if backwards:
+            # the highest ids below the first one of the next page
+            rest = bits & ((1 << values[0]) - 1)
+            while rest and len(ids) <= per_page:
+                top = rest.bit_length() - 1
+                ids.append(top)
+                rest ^= 1 << top
+            has_more = len(ids) > per_page
+            ids = ids[:per_page][::-1]
+            has_next, has_previous = True, has_more
+        else:
+            rest = bits >> (values[0] + 1) << (values[0] + 1) if values else bits
+            while rest and len(ids) <= per_page:
+                low = rest & -rest
+                ids.append(low.bit_length() - 1)
+                rest ^= low
+            has_more = len(ids) > per_page
+            ids = ids[:per_page]
+            has_next, has_previous = has_more, values is not None
+        number = max(number, 1) if has_previous else 1
+        next_cursor = previous_cursor = None
+        if ids and has_next:
+            next_cursor = encode_cursor(NEXT, number + 1, [ids[-1]])
+        if ids and has_previous:
+            previous_cursor = encode_cursor(PREVIOUS, number - 1, [ids[0]])
+        return KeysetPage(ids, number, next_cursor, previous_cursor)
+
+
+def get_facet_index():
+    index = cache.get(FACET_INDEX_KEY)
+    if index is None:
+        index = rebuild_facet_index()
+    return index
+
+
+def rebuild_facet_index():
+    index = FacetIndex.build()
+    cache.set(FACET_INDEX_KEY, index, FACET_INDEX_TIMEOUT)
+    return index
+
+
+def update_facet_index(item_id, values=None):
+    """
+    Moves an item to the facet values it has now, or out of the index
+    when values is None, once the change is committed. Concurrent updates
+    take turns on a cache lock; when it can't be had the index is dropped
+    and rebuilt by the next reader instead.
+    """
+    def update():
+        for _ in range(50):
+            if cache.add(FACET_INDEX_LOCK, True, 5):
+                break
+            time.sleep(0.01)
+        else:
+            cache.delete(FACET_INDEX_KEY)
+            return
+        try:
+            index = cache.get(FACET_INDEX_KEY)
+            if index is None:
+                return
+            index.remove(item_id)
+            if values is not None:
+                index.add(item_id, values)
+            cache.set(FACET_INDEX_KEY, index, FACET_INDEX_TIMEOUT)
+        finally:
+            cache.delete(FACET_INDEX_LOCK)
+
+    transaction.on_commit(update)
@@ -0,0 +1,47 @@
+import csv
+import io
+import json
+import time
+from django.core.management.base import BaseCommand
+from core.analytics import MEASURES, SalesReport
+
+
+class Command(BaseCommand):
+    help = ('Revenue, units sold, savings and line counts of every completed order, '
+            'live and archived, per category, item or day (UTC), as CSV or JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--by', nargs='+', choices=['category', 'item', 'day'],
+                            default=['category'])
+        parser.add_argument('--format', choices=['csv', 'json'], default='csv')
+        parser.add_argument('--output', help='File to write to, by default stdout')
+        parser.add_argument('--chunk-size', type=int, default=50000,
+                            help='Order lines fetched and summed at a time')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        report = SalesReport(options['chunk_size']).run()
+        tables = {by: report.rows(by) for by in options['by']}
+        if options['output']:
+            with open(options['output'], 'w', newline='') as stream:
+                self.write(stream, tables, options['format'])
+        else:
+            buffer = io.StringIO()
+            self.write(buffer, tables, options['format'])
+            self.stdout.write(buffer.getvalue(), ending='')
+        if options['verbosity'] > 1 or options['output']:
+            self.stderr.write('%d order lines in %.1fs' % (
+                report.lines, time.perf_counter() - started))
+
+    def write(self, stream, tables, format):
+        if format == 'json':
+            json.dump({by: [dict(zip(keys + list(MEASURES), row)) for row in rows]
+                       for by, (keys, rows) in tables.items()}, stream, indent=2)
+            stream.write('\n')
+            return
+        writer = csv.writer(stream)
+        for n, (by, (keys, rows)) in enumerate(tables.items()):
+            if n:
+                stream.write('\n')
+            writer.writerow(keys + list(MEASURES))
+            writer.writerows(rows)
@@ -0,0 +1,27 @@
+import time
+from django.core.management.base import BaseCommand
+from core.archive import archive_orders
+
+
+class Command(BaseCommand):
+    help = ('Moves orders completed more than --days days ago into the archive '
+            'tables, a batch per transaction. Safe to interrupt: the next run '
+            'carries on with the orders that are left.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90)
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--max-batches', type=int,
+                            help='Stop after this many batches, to bound a run')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        self.started = time.perf_counter()
+        orders, lines = archive_orders(options['days'], options['batch_size'],
+                                       options['max_batches'], progress=self.progress)
+        self.stdout.write(self.style.SUCCESS('Archived %d orders with %d lines in %.1fs' % (
+            orders, lines, time.perf_counter() - self.started)))
+
+    def progress(self, orders, lines):
+        if self.verbosity > 1:
+            self.stdout.write('%d orders, %d lines' % (orders, lines))
@@ -0,0 +1,70 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from core.catalog import WORDS
+from core.models import CATEGORY_CHOICES, LABEL_CHOICES, Item
+from core.search import get_search_backend
+
+
+def percentile(timings, pct):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(len(timings) * pct / 100))]
+
+
+class Command(BaseCommand):
+    help = ('Times catalog search against a synthetic catalog. '
+            'The catalog is created inside a transaction that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=100000,
+                            help='Size of the synthetic catalog')
+        parser.add_argument('--queries', type=int, default=200,
+                            help='Number of search queries to time')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            self.create_catalog(rng, options['items'])
+            queries = [' '.join(rng.sample(WORDS, rng.randint(1, 2)))
+                       for _ in range(options['queries'])]
+            backend = get_search_backend()
+            self.report(type(backend).__name__, queries,
+                        lambda query: backend.search(Item.objects.all(), query))
+            self.report('icontains (previous)', queries,
+                        lambda query: Item.objects.filter(title__icontains=query))
+            transaction.set_rollback(True)
+
+    def create_catalog(self, rng, size, batch_size=5000):
+        started = time.perf_counter()
+        categories = [value for value, name in CATEGORY_CHOICES]
+        labels = [value for value, name in LABEL_CHOICES]
+        for offset in range(0, size, batch_size):
+            Item.objects.bulk_create([
+                Item(
+                    title=' '.join(rng.sample(WORDS, 3)),
+                    price=round(rng.uniform(5, 200), 2),
+                    description=' '.join(rng.choices(WORDS, k=30)),
+                    category=rng.choice(categories),
+                    label=rng.choice(labels),
+                    slug=f'benchmark-{n}',
+                )
+                for n in range(offset, min(offset + batch_size, size))
+            ])
+        get_search_backend().rebuild()
+        self.stdout.write('Created %d items in %.1fs' % (
+            size, time.perf_counter() - started))
+
+    def report(self, name, queries, search):
+        timings = []
+        for query in queries:
+            started = time.perf_counter()
+            queryset = search(query)
+            queryset.count()
+            list(queryset[:12])
+            timings.append((time.perf_counter() - started) * 1000)
+        self.stdout.write(
+            '%-24s p50 %8.2fms  p95 %8.2fms  p99 %8.2fms' % (
+                name, percentile(timings, 50), percentile(timings, 95),
+                percentile(timings, 99)))
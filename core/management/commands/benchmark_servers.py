@@ -0,0 +1,146 @@
+import asyncio
+import os
+import shlex
+import socket
+import subprocess
+import time
+from django.core.management.base import BaseCommand, CommandError
+from .benchmark_search import percentile
+
+WSGI_COMMAND = ('gunicorn djecommerce.wsgi:application --worker-class gthread --workers 1 '
+                '--threads {threads} --bind 127.0.0.1:{port}')
+ASGI_COMMAND = ('uvicorn djecommerce.asgi:application --workers 1 '
+                '--host 127.0.0.1 --port {port} --no-access-log')
+
+
+async def read_response(reader):
+    """Reads one HTTP/1.1 response, returns its status code."""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('connection closed')
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.readexactly(int(headers.get('content-length', 0)))
+    if headers.get('connection', '').lower() == 'close':
+        raise ConnectionResetError('server closed the connection')
+    return int(status_line.split()[1])
+
+
+class Command(BaseCommand):
+    help = ('Compares the throughput of the WSGI (gunicorn, gthread) and ASGI (uvicorn) '
+            'entry points under concurrent keep-alive clients. Each server is started '
+            'with the current settings and database, so fill the catalog first, e.g. '
+            'with prepopulate.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=100,
+                            help='Concurrent keep-alive connections')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds per server')
+        parser.add_argument('--think-time', type=float, default=0.05,
+                            help='Seconds a client waits between requests, like a slow '
+                                 'mobile connection keeping its socket open')
+        parser.add_argument('--threads', type=int, default=10,
+                            help='gunicorn threads, and ASGI_THREADS for uvicorn')
+        parser.add_argument('--paths', nargs='+', default=['/', '/category/shirt/'])
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--wsgi-command', default=WSGI_COMMAND)
+        parser.add_argument('--asgi-command', default=ASGI_COMMAND)
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.stdout.write('%-6s %8s %7s %9s %9s %9s %9s' % (
+            'server', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+        for name in ('wsgi', 'asgi'):
+            command = options[f'{name}_command'].format(
+                threads=options['threads'], port=options['port'])
+            result = self.run_server(command)
+            self.stdout.write('%-6s %8d %7d %9.1f %9.2f %9.2f %9.2f' % (
+                name, result['requests'], result['errors'], result['throughput'],
+                result['p50'], result['p95'], result['p99']))
+
+    def run_server(self, command):
+        env = dict(os.environ, ASGI_THREADS=str(self.options['threads']),
+                   PYTHONPATH=os.pathsep.join(filter(None, [os.getcwd(),
+                                                            os.environ.get('PYTHONPATH')])))
+        server = subprocess.Popen(shlex.split(command), env=env, stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.PIPE)
+        try:
+            self.wait_for_port(server)
+            return asyncio.run(self.load())
+        finally:
+            server.terminate()
+            try:
+                server.wait(10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+    def wait_for_port(self, server, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError('The server exited:\n' + server.stderr.read().decode())
+            try:
+                socket.create_connection(('127.0.0.1', self.options['port']), 0.5).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        raise CommandError('The server did not start listening')
+
+    async def load(self):
+        timings, errors = [], []
+        deadline = time.monotonic() + self.options['duration']
+        paths = self.options['paths']
+        started = time.monotonic()
+        await asyncio.gather(*[
+            self.client(n, paths, deadline, timings, errors)
+            for n in range(self.options['clients'])])
+        elapsed = time.monotonic() - started
+        if not timings:
+            raise CommandError('No request succeeded: %s' % (errors[:1],))
+        return {
+            'requests': len(timings),
+            'errors': len(errors),
+            'throughput': len(timings) / elapsed,
+            'p50': percentile(timings, 50),
+            'p95': percentile(timings, 95),
+            'p99': percentile(timings, 99),
+        }
+
+    async def client(self, n, paths, deadline, timings, errors):
+        port = self.options['port']
+        writer = None
+        request_number = n
+        while time.monotonic() < deadline:
+            path = paths[request_number % len(paths)]
+            request_number += 1
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                started = time.perf_counter()
+                writer.write(f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\n\r\n'.encode())
+                status = await read_response(reader)
+                timings.append((time.perf_counter() - started) * 1000)
+                if status >= 400:
+                    errors.append(status)
+            except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+                errors.append(repr(e))
+                if writer is not None:
+                    writer.close()
+                writer = None
+                await asyncio.sleep(0.05)
+                continue
+            await asyncio.sleep(self.options['think_time'])
+        if writer is not None:
+            writer.close()
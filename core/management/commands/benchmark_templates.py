@@ -0,0 +1,52 @@
+import random
+import time
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.template import engines
+from core.catalog import WORDS
+from core.models import CATEGORY_CHOICES, LABEL_CHOICES, Item
+from .benchmark_search import percentile
+
+GRIDS = {
+    'per-item render (previous)':
+        "{% for item in items %}{% include 'pages/card.html' %}{% endfor %}",
+    'cached cards': '{% load catalog_template_tags %}{% item_cards items %}',
+}
+
+
+class Command(BaseCommand):
+    help = ('Times rendering the catalog grid of a page, card by card as before and '
+            'from the card cache, for pages of --page-sizes items. Uses unsaved '
+            'items, so no database is needed.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-sizes', type=int, nargs='+', default=[12, 48])
+        parser.add_argument('--renders', type=int, default=500)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        categories = [value for value, name in CATEGORY_CHOICES]
+        labels = [value for value, name in LABEL_CHOICES]
+        engine = engines['django']
+        self.stdout.write('%-28s %5s %9s %9s %9s' % ('grid', 'items', 'p50 ms', 'p95 ms', 'cold ms'))
+        for size in options['page_sizes']:
+            items = [Item(pk=n + 1, title=' '.join(rng.sample(WORDS, 3)),
+                          price=round(rng.uniform(5, 200), 2),
+                          discount_price=rng.choice([None, round(rng.uniform(1, 5), 2)]),
+                          category=rng.choice(categories), label=rng.choice(labels),
+                          slug=f'benchmark-{n}')
+                     for n in range(size)]
+            for name, source in GRIDS.items():
+                grid = engine.from_string(source)
+                cache.clear()
+                started = time.perf_counter()
+                grid.render({'items': items})
+                cold = (time.perf_counter() - started) * 1000
+                timings = []
+                for _ in range(options['renders']):
+                    started = time.perf_counter()
+                    grid.render({'items': items})
+                    timings.append((time.perf_counter() - started) * 1000)
+                self.stdout.write('%-28s %5d %9.3f %9.3f %9.3f' % (
+                    name, size, percentile(timings, 50), percentile(timings, 95), cold))
@@ -0,0 +1,221 @@
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import (
+    CaptureQueriesContext, setup_test_environment, teardown_test_environment)
+from django.urls import reverse
+from django.utils import timezone
+from core.catalog import WORDS, CatalogImporter, synthetic_rows
+from core.models import CATEGORY_CHOICES, Item, Order, OrderItem
+from .benchmark_search import percentile
+
+CHECKOUT_FORM = {'street_address': '1234 Main St', 'country': 'BD', 'zip_code': '1000',
+                 'payment_option': 'S'}
+
+
+def find_regressions(results, baseline, tolerance):
+    """
+    Views slower at p95 than the baseline allows, or running more queries
+    than the baseline did.
+    """
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        if result['p95'] > expected['p95'] * (1 + tolerance):
+            regressions.append('%s: p95 %.2fms, baseline %.2fms' % (
+                name, result['p95'], expected['p95']))
+        if result['queries'] > expected['queries']:
+            regressions.append('%s: %d queries, baseline %d' % (
+                name, result['queries'], expected['queries']))
+    return regressions
+
+
+class Command(BaseCommand):
+    help = ('Load-tests the storefront views through the test client with concurrent '
+            'workers, against a throwaway test database filled with a synthetic '
+            'catalog, users and carts. Reports p50/p95/p99 latency, throughput and '
+            'queries per request, and fails when a baseline is exceeded.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=10000)
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--cart-size', type=int, default=5)
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Requests per view')
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--views', nargs='*', help='Only run these views')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--baseline', help='JSON file of results to compare against')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed p95 slowdown over the baseline, 0.25 is 25%%')
+        parser.add_argument('--save-baseline', help='Write the results to this JSON file')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.rng = random.Random(options['seed'])
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as baseline_file:
+                baseline = json.load(baseline_file)
+
+        setup_test_environment()
+        old_name = self.create_test_db()
+        try:
+            cache.clear()
+            self.create_fixtures()
+            results = self.run_views()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as baseline_file:
+                json.dump(results, baseline_file, indent=2, sort_keys=True)
+        if baseline is not None:
+            regressions = find_regressions(results, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError('Slower than the baseline:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('Within the baseline'))
+
+    def create_test_db(self):
+        settings_dict = connection.settings_dict
+        if connection.vendor == 'sqlite' and not settings_dict['TEST']['NAME']:
+            # the workers need a database they can share across threads
+            settings_dict['TEST']['NAME'] = os.path.join(
+                tempfile.mkdtemp(), 'benchmark.sqlite3')
+        old_name = settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        return old_name
+
+    def create_fixtures(self):
+        started = time.perf_counter()
+        CatalogImporter(5000).run(synthetic_rows(self.options['items'], self.options['seed']))
+        self.slugs = list(Item.objects.values_list('slug', flat=True))
+        User = get_user_model()
+        # hashing a password per user would dominate the set up
+        password = make_password('benchmark')
+        User.objects.bulk_create([
+            User(username=f'benchmark-{n}', password=password)
+            for n in range(self.options['users'])
+        ])
+        self.users = list(User.objects.filter(username__startswith='benchmark-'))
+        prices = {pk: (price, discount_price) for pk, price, discount_price in
+                  Item.objects.values_list('pk', 'price', 'discount_price')}
+        item_ids = list(prices)
+        for user in self.users:
+            order = Order.objects.create(user=user, ordered_date=timezone.now())
+            OrderItem.objects.bulk_create([
+                OrderItem(user=user, item_id=item_id, quantity=self.rng.randint(1, 3),
+                          price=prices[item_id][0], discount_price=prices[item_id][1])
+                for item_id in self.rng.sample(item_ids, self.options['cart_size'])
+            ])
+            order.items.add(*OrderItem.objects.filter(user=user))
+        self.stdout.write('%d items, %d users with %d item carts in %.1fs' % (
+            len(self.slugs), len(self.users), self.options['cart_size'],
+            time.perf_counter() - started))
+
+    def views(self):
+        """
+        (name, logged in, writes, request) for every view, where
+        request(client, rng) returns the response.
+        """
+        categories = [value for value, name in CATEGORY_CHOICES]
+
+        def slug(rng):
+            return rng.choice(self.slugs)
+
+        return [
+            ('home', False, False, lambda client, rng: client.get(reverse('core:home'))),
+            ('item_category', False, False, lambda client, rng: client.get(
+                reverse('core:item_category', args=[rng.choice(categories)]))),
+            ('item_search', False, False, lambda client, rng: client.get(
+                reverse('core:item_search'), {'query': rng.choice(WORDS)})),
+            ('product', False, False, lambda client, rng: client.get(
+                reverse('core:product', args=[slug(rng)]))),
+            ('add-to-cart (anonymous)', False, False, lambda client, rng: client.get(
+                reverse('core:add-to-cart', args=[slug(rng)]))),
+            ('order-summery', True, False, lambda client, rng: client.get(
+                reverse('core:order-summery'))),
+            ('add-to-cart', True, True, lambda client, rng: client.get(
+                reverse('core:add-to-cart', args=[slug(rng)]))),
+            ('remove-single-item', True, True, lambda client, rng: client.get(
+                reverse('core:remove-single-item', args=[slug(rng)]))),
+            ('checkout', True, False, lambda client, rng: client.get(
+                reverse('core:checkout'))),
+            ('checkout (post)', True, True, lambda client, rng: client.post(
+                reverse('core:checkout'), CHECKOUT_FORM)),
+        ]
+
+    def run_views(self):
+        only = self.options['views']
+        results = {}
+        self.stdout.write('%-26s %6s %9s %9s %9s %9s %8s' % (
+            'view', 'reqs', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'queries'))
+        for name, logged_in, writes, request in self.views():
+            if only and name not in only:
+                continue
+            workers = self.options['workers']
+            if writes and connection.vendor == 'sqlite':
+                # SQLite takes one writer at a time, concurrent write
+                # transactions fail with "database is locked"
+                workers = 1
+            results[name] = result = self.run_view(logged_in, request, workers)
+            self.stdout.write('%-26s %6d %9.2f %9.2f %9.2f %9.1f %8d' % (
+                name, result['requests'], result['p50'], result['p95'], result['p99'],
+                result['throughput'], result['queries']))
+        return results
+
+    def run_view(self, logged_in, request, workers):
+        per_worker = max(1, self.options['requests'] // workers)
+        timings, queries, errors = [], [], []
+        clients = [Client() for n in range(workers)]
+        if logged_in:
+            for n, client in enumerate(clients):
+                client.force_login(self.users[n % len(self.users)])
+
+        def worker(n):
+            rng = random.Random(self.options['seed'] * 1000 + n)
+            client = clients[n]
+            try:
+                for _ in range(per_worker):
+                    with CaptureQueriesContext(connection) as context:
+                        started = time.perf_counter()
+                        response = request(client, rng)
+                        elapsed = (time.perf_counter() - started) * 1000
+                    if response.status_code >= 400:
+                        errors.append(response.status_code)
+                    timings.append(elapsed)
+                    queries.append(len(context.captured_queries))
+            except Exception as e:
+                errors.append(repr(e))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker, args=[n]) for n in range(workers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+        if errors:
+            raise CommandError(f'{len(errors)} requests failed, e.g. with {errors[0]}')
+        return {
+            'requests': len(timings),
+            'p50': percentile(timings, 50),
+            'p95': percentile(timings, 95),
+            'p99': percentile(timings, 99),
+            'throughput': len(timings) / wall,
+            'queries': percentile(queries, 50),
+        }
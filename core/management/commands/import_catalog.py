@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from core.catalog import CatalogImporter, read_rows
+
+
+class Command(BaseCommand):
+    help = ('Imports items from CSV or JSON lines files, a batch at a time. '
+            'Columns: title, price, discount_price, description, category, label '
+            'and an optional slug; a row whose slug exists updates that item.')
+    files_nargs = '+'
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs=self.files_nargs, help='CSV or .jsonl files, - for stdin')
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='File format, by default taken from the file extension')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        self.import_rows(self.read_files(options['files'], options['format']), options)
+
+    def import_rows(self, rows, options):
+        self.verbosity = options['verbosity']
+        self.started = time.perf_counter()
+        importer = CatalogImporter(options['batch_size'], progress=self.progress)
+        importer.run(rows)
+        for line_num, error in importer.errors:
+            self.stderr.write(f'line {line_num}: {error}')
+        elapsed, rate = self.rate(importer)
+        self.stdout.write(self.style.SUCCESS(
+            '%d rows in %.1fs (%.0f rows/s): %d created, %d updated, %d invalid' % (
+                importer.rows, elapsed, rate, importer.created, importer.updated,
+                importer.invalid)))
+
+    def read_files(self, paths, format=None):
+        for path in paths:
+            if path == '-':
+                yield from read_rows(sys.stdin, format or 'csv')
+                continue
+            try:
+                with open(path, newline='', encoding='utf-8') as stream:
+                    yield from read_rows(stream, format or self.guess_format(path))
+            except OSError as e:
+                raise CommandError(e)
+
+    def guess_format(self, path):
+        extension = os.path.splitext(path)[1].lower()
+        if extension in ('.jsonl', '.ndjson'):
+            return 'jsonl'
+        if extension == '.csv':
+            return 'csv'
+        raise CommandError(f'Unknown format for {path}, use --format')
+
+    def rate(self, importer):
+        elapsed = time.perf_counter() - self.started
+        return elapsed, importer.rows / elapsed if elapsed else 0
+
+    def progress(self, importer):
+        if self.verbosity > 1:
+            elapsed, rate = self.rate(importer)
+            self.stdout.write('%d rows, %.0f rows/s' % (importer.rows, rate))
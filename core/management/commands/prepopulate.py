@@ -0,0 +1,19 @@
+from core.catalog import synthetic_rows
+from .import_catalog import Command as ImportCatalogCommand
+
+
+class Command(ImportCatalogCommand):
+    help = ('Fills the catalog with sample items, or imports the given files. '
+            'Sample items keep their slugs, so running it again updates them.')
+    files_nargs = '*'
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--items', type=int, default=120,
+                            help='Number of sample items when no files are given')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options['files']:
+            return super().handle(*args, **options)
+        self.import_rows(synthetic_rows(options['items'], options['seed']), options)
@@ -0,0 +1,24 @@
+import time
+from django.core.management.base import BaseCommand
+from core.purge import purge_carts
+
+
+class Command(BaseCommand):
+    help = ('Deletes the carts nobody changed for --days days and the order items '
+            'no order refers to, a batch per transaction. Meant to run on a schedule.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30)
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        started = time.perf_counter()
+        carts, items = purge_carts(options['days'], options['batch_size'],
+                                   progress=self.progress)
+        self.stdout.write(self.style.SUCCESS('Deleted %d idle carts and %d order items in %.1fs' % (
+            carts, items, time.perf_counter() - started)))
+
+    def progress(self, carts, items):
+        if self.verbosity > 1:
+            self.stdout.write('%d carts, %d order items' % (carts, items))
@@ -0,0 +1,27 @@
+import time
+from django.core.management.base import BaseCommand
+from core import recommendations
+
+
+class Command(BaseCommand):
+    help = ('Counts the orders completed since the last run into the "frequently '
+            'bought together" item pairs, a chunk of orders per transaction. '
+            'Meant to run on a schedule; --rebuild starts over from the first order.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Orders per transaction')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Forget every count and count all orders again')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        started = time.perf_counter()
+        if options['rebuild']:
+            recommendations.reset()
+        orders, pairs = recommendations.refresh(options['chunk_size'], progress=self.progress)
+        self.stdout.write(self.style.SUCCESS('Counted %d orders (%d item pairs) in %.1fs' % (
+            orders, pairs, time.perf_counter() - started)))
+
+    def progress(self, orders, pairs):
+        if self.verbosity > 1:
+            self.stdout.write('%d orders, %d item pairs' % (orders, pairs))
@@ -0,0 +1,76 @@
+import time
+from django.conf import settings
+from django.db import connection
+from . import profiling
+from .cart import CookieCart
+
+CART_COOKIE_NAME = 'cart'
+CART_COOKIE_SALT = 'core.cart'
+CART_COOKIE_AGE = 60 * 60 * 24 * 30
+
+
+class CookieCartMiddleware:
+    """
+    Loads the anonymous visitor's cart from a signed cookie into
+    request.cookie_cart and writes it back when a view changed it.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.cookie_cart = CookieCart.loads(request.get_signed_cookie(
+            CART_COOKIE_NAME, default=None, salt=CART_COOKIE_SALT))
+        response = self.get_response(request)
+        if request.cookie_cart.modified:
+            if request.cookie_cart:
+                response.set_signed_cookie(
+                    CART_COOKIE_NAME, request.cookie_cart.dumps(), salt=CART_COOKIE_SALT,
+                    max_age=CART_COOKIE_AGE, secure=settings.SESSION_COOKIE_SECURE,
+                    httponly=True, samesite='Lax')
+            else:
+                response.delete_cookie(CART_COOKIE_NAME)
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Times the SQL queries, template rendering and view of every request,
+    sends them back in a Server-Timing header when settings.SERVER_TIMING
+    is on and adds them to the per-URL-name statistics served by the
+    staff-only profiling_stats view.
+    Goes first in MIDDLEWARE so that total covers the other middleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        profiling.install_template_timer()
+
+    def __call__(self, request):
+        timings = profiling.RequestTimings()
+        token = profiling.current.set(timings)
+        started = request.view_started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(timings):
+                response = self.get_response(request)
+        finally:
+            profiling.current.reset(token)
+        finished = time.perf_counter()
+        total = (finished - started) * 1000
+        view = (finished - request.view_started) * 1000
+        db, template = timings.db * 1000, timings.template * 1000
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = ', '.join([
+                'db;dur=%.1f;desc="%d queries"' % (db, timings.queries),
+                'tpl;dur=%.1f' % template,
+                'view;dur=%.1f' % view,
+                'total;dur=%.1f' % total,
+            ])
+        match = request.resolver_match
+        if match is not None:
+            profiling.view_stats.record(
+                match.view_name, total, view, db, template, timings.queries)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.view_started = time.perf_counter()
@@ -0,0 +1,46 @@
+# Generated by Django 3.0 on 2026-10-18 19:16
+
+from django.db import migrations, models
+from django.db.models import (
+    Case, Count, ExpressionWrapper, F, FloatField, OuterRef, Q, Subquery, Sum, When)
+from django.db.models.functions import Coalesce
+
+
+def line_price(price):
+    return ExpressionWrapper(F('orderitem__quantity') * F(price), output_field=FloatField())
+
+
+def backfill_order_totals(apps, schema_editor):
+    # a single UPDATE, as Order.update_totals() with the item's prices
+    Order = apps.get_model('core', 'Order')
+    lines = Order.items.through.objects.filter(order=OuterRef('pk')).values('order')
+    on_sale = (Q(orderitem__item__discount_price__isnull=False) &
+               ~Q(orderitem__item__discount_price=0))
+    final_price = Case(
+        When(on_sale, then=line_price('orderitem__item__discount_price')),
+        default=line_price('orderitem__item__price'), output_field=FloatField())
+    Order.objects.update(
+        total=Coalesce(Subquery(lines.annotate(total=Sum(final_price)).values('total')), 0.0),
+        item_count=Coalesce(Subquery(lines.annotate(count=Count('pk')).values('count')), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_auto_20210131_1048'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(backfill_order_totals, migrations.RunPython.noop),
+    ]
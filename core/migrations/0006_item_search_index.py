@@ -0,0 +1,39 @@
+# Generated by Django 3.0 on 2026-10-18 19:40
+
+from django.db import migrations
+
+ITEM_TSVECTOR = ("to_tsvector('english', coalesce(title, '') || ' ' || "
+                 "coalesce(description, '') || ' ' || coalesce(category, ''))")
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE core_item_fts USING fts5("
+            "title, description, category, tokenize = 'porter unicode61')")
+        schema_editor.execute(
+            'INSERT INTO core_item_fts (rowid, title, description, category) '
+            'SELECT id, title, description, category FROM core_item')
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            f'CREATE INDEX core_item_search_idx ON core_item USING GIN ({ITEM_TSVECTOR})')
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE core_item_fts')
+    elif vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX core_item_search_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_order_totals'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
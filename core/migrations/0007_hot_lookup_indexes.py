@@ -0,0 +1,51 @@
+# Generated by Django 3.0 on 2026-10-18 19:20
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+from django.utils.text import slugify
+
+
+def deduplicate_slugs(apps, schema_editor):
+    Item = apps.get_model('core', 'Item')
+    missing = Item.objects.filter(Q(slug='') | Q(slug__isnull=True))
+    duplicated = Item.objects.exclude(Q(slug='') | Q(slug__isnull=True)).values(
+        'slug').annotate(rows=Count('id')).filter(rows__gt=1).values_list('slug', flat=True)
+    for slug in list(duplicated):
+        # the oldest item keeps its slug, the others get a numbered one
+        for item in Item.objects.filter(slug=slug).order_by('id')[1:]:
+            assign_slug(Item, item, slug)
+    for item in missing.order_by('id'):
+        assign_slug(Item, item, slugify(item.title) or 'item')
+
+
+def assign_slug(Item, item, base):
+    slug, n = base, 1
+    while Item.objects.filter(slug=slug).exclude(pk=item.pk).exists():
+        n += 1
+        slug = f'{base}-{n}'
+    item.slug = slug
+    item.save(update_fields=['slug'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_item_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_slugs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='item',
+            name='slug',
+            field=models.SlugField(blank=True, null=True, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['category', 'id'], name='core_item_category_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'ordered'], name='core_order_user_ordered_idx'),
+        ),
+    ]
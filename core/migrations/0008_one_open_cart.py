@@ -0,0 +1,91 @@
+# Generated by Django 3.0 on 2026-10-18 19:22
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def recompute_totals(order):
+    lines = list(order.items.select_related('item'))
+    order.total = sum(line.quantity * (line.item.discount_price or line.item.price)
+                      for line in lines)
+    order.item_count = len(lines)
+    order.save(update_fields=['total', 'item_count'])
+
+
+def freeze_placed_lines(apps, schema_editor):
+    """
+    Marks the lines of placed orders ordered, which checkout never did. A
+    cart used to pick up its owner's line of a placed order again, so an
+    open order sharing such a line gets a copy of its own.
+    """
+    Order = apps.get_model('core', 'Order')
+    OrderItem = apps.get_model('core', 'OrderItem')
+    OrderLine = Order.items.through
+
+    placed = OrderItem.objects.filter(ordered=False, order__ordered=True)
+    shared = OrderLine.objects.filter(order__ordered=False, orderitem__in=placed)
+    for line in shared.select_related('orderitem'):
+        orderitem = line.orderitem
+        copy = OrderItem.objects.create(user_id=orderitem.user_id, item_id=orderitem.item_id,
+                                        quantity=orderitem.quantity)
+        OrderLine.objects.filter(pk=line.pk).update(orderitem=copy)
+    OrderItem.objects.filter(ordered=False, order__ordered=True).update(ordered=True)
+
+
+def merge_duplicate_carts(apps, schema_editor):
+    Order = apps.get_model('core', 'Order')
+    OrderItem = apps.get_model('core', 'OrderItem')
+    OrderLine = Order.items.through
+
+    users = Order.objects.filter(ordered=False).values('user').annotate(
+        carts=Count('id')).filter(carts__gt=1).values_list('user', flat=True)
+    for user_id in list(users):
+        # the oldest open order keeps the lines of the others
+        keep, *others = Order.objects.filter(user_id=user_id, ordered=False).order_by('id')
+        kept = set(keep.items.values_list('pk', flat=True))
+        for order in others:
+            for orderitem_id in order.items.values_list('pk', flat=True):
+                if orderitem_id not in kept:
+                    OrderLine.objects.create(order=keep, orderitem_id=orderitem_id)
+                    kept.add(orderitem_id)
+            order.delete()
+        recompute_totals(keep)
+
+    lines = OrderItem.objects.filter(ordered=False, user__isnull=False).values(
+        'user', 'item').annotate(rows=Count('id')).filter(rows__gt=1)
+    for line in list(lines):
+        duplicates = list(OrderItem.objects.filter(
+            ordered=False, user_id=line['user'], item_id=line['item']).order_by('id'))
+        in_cart = [orderitem for orderitem in duplicates if orderitem.order_set.exists()]
+        keep = in_cart[0] if in_cart else duplicates[0]
+        keep.quantity = sum(orderitem.quantity for orderitem in in_cart) or keep.quantity
+        keep.save(update_fields=['quantity'])
+        orders = {order.pk: order for orderitem in in_cart for order in orderitem.order_set.all()}
+        for orderitem in duplicates:
+            if orderitem.pk != keep.pk:
+                for order in orderitem.order_set.all():
+                    if not OrderLine.objects.filter(order=order, orderitem=keep).exists():
+                        OrderLine.objects.create(order=order, orderitem=keep)
+                orderitem.delete()
+        for order in orders.values():
+            recompute_totals(order)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_hot_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(freeze_placed_lines, migrations.RunPython.noop),
+        migrations.RunPython(merge_duplicate_carts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(ordered=False), fields=('user',), name='core_order_one_open_cart'),
+        ),
+        migrations.AddConstraint(
+            model_name='orderitem',
+            constraint=models.UniqueConstraint(condition=models.Q(ordered=False), fields=('user', 'item'), name='core_orderitem_one_open_line'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.0 on 2026-10-18 19:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_order_updated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='price',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='discount_price',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
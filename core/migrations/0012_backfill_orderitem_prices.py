@@ -0,0 +1,38 @@
+# Generated by Django 3.0 on 2026-10-18 19:58
+
+from django.db import migrations, models, transaction
+from django.db.models import OuterRef, Subquery
+
+BATCH_SIZE = 5000
+
+
+def copy_item_prices(apps, schema_editor):
+    Item = apps.get_model('core', 'Item')
+    OrderItem = apps.get_model('core', 'OrderItem')
+    items = Item.objects.filter(pk=OuterRef('item_id'))
+    # a short transaction per range of ids; rows already copied are skipped,
+    # so an interrupted run picks up where it stopped
+    last = OrderItem.objects.aggregate(last=models.Max('pk'))['last'] or 0
+    for start in range(0, last, BATCH_SIZE):
+        with transaction.atomic():
+            OrderItem.objects.filter(
+                pk__gt=start, pk__lte=start + BATCH_SIZE, price__isnull=True).update(
+                price=Subquery(items.values('price')),
+                discount_price=Subquery(items.values('discount_price')))
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('core', '0011_orderitem_prices'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_item_prices, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='price',
+            field=models.FloatField(),
+        ),
+    ]
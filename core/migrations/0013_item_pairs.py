@@ -0,0 +1,40 @@
+# Generated by Django 3.0 on 2026-10-18 19:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_backfill_orderitem_prices'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='pairs_counted',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='ItemPair',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.IntegerField(default=0)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pairs', to='core.Item')),
+                ('other', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.Item')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='itempair',
+            index=models.Index(fields=['item', '-count'], name='core_itempair_item_count_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='itempair',
+            constraint=models.UniqueConstraint(fields=('item', 'other'), name='core_itempair_unique'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('ordered', True), ('pairs_counted', False)), fields=['id'], name='core_order_uncounted_idx'),
+        ),
+    ]
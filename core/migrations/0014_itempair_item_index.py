@@ -0,0 +1,19 @@
+# Generated by Django 3.0 on 2026-10-18 20:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_item_pairs'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='itempair',
+            name='item',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='pairs', to='core.Item'),
+        ),
+    ]
@@ -1,6 +1,11 @@
 from django.conf import settings
 from django.db import models
+from django.db.models import (
+    Case, Count, ExpressionWrapper, F, FloatField, OuterRef, Prefetch, Q, Subquery, Sum,
+    When)
+from django.db.models.functions import Coalesce
 from django.shortcuts import reverse
+from django.utils import timezone
 from django.utils.text import slugify
 from django_countries.fields import CountryField
 
@@ -24,13 +29,27 @@ class Item(models.Model):
     description = models.TextField()
     category = models.CharField(choices=CATEGORY_CHOICES, max_length=10)
     label = models.CharField(choices=LABEL_CHOICES, max_length=1)
-    slug = models.SlugField(blank=True, null=True)
+    slug = models.SlugField(unique=True, blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # serves both the category filter and the keyset ordering on id
+            models.Index(fields=['category', 'id'], name='core_item_category_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.slug:
-            self.slug = slugify(self.title)
+            self.slug = self.unique_slug()
         super(Item, self).save(*args, **kwargs)
 
+    def unique_slug(self):
+        base = slugify(self.title) or 'item'
+        slug, n = base, 1
+        while Item.objects.filter(slug=slug).exclude(pk=self.pk).exists():
+            n += 1
+            slug = f'{base}-{n}'
+        return slug
+
     def __str__(self):
         return self.title
 
@@ -44,21 +63,131 @@ class Item(models.Model):
         return reverse('core:remove-from-cart', kwargs={'slug': self.slug})
 
 
+def line_total_expressions(prefix=''):
+    """
+    SQL expressions for the per-line totals of OrderItem rows, mirroring
+    get_item_total_price(), get_amount_saved() and get_final_price(). They
+    only read the line's own price columns, no join to Item.
+    `prefix` is the lookup path from the queried model to OrderItem.
+    """
+    quantity = F(prefix + 'quantity')
+    on_sale = (Q(**{prefix + 'discount_price__isnull': False}) &
+               ~Q(**{prefix + 'discount_price': 0}))
+    total_price = ExpressionWrapper(
+        quantity * F(prefix + 'price'), output_field=FloatField())
+    total_discount_price = ExpressionWrapper(
+        quantity * F(prefix + 'discount_price'), output_field=FloatField())
+    return {
+        'total_price': total_price,
+        'amount_saved': Case(
+            When(on_sale, then=total_price - total_discount_price),
+            default=0.0, output_field=FloatField()),
+        'final_price': Case(
+            When(on_sale, then=total_discount_price),
+            default=total_price, output_field=FloatField()),
+    }
+
+
+def item_prices(item):
+    """
+    OrderItem price field values copying the current prices of item, an
+    Item id or an OuterRef to one, read by the INSERT or UPDATE itself.
+    """
+    items = Item.objects.filter(pk=item)
+    return {'price': Subquery(items.values('price')),
+            'discount_price': Subquery(items.values('discount_price'))}
+
+
+class OrderItemQuerySet(models.QuerySet):
+    def snapshot_prices(self):
+        """Copies the current prices of their items onto the lines."""
+        return self.update(**item_prices(OuterRef('item_id')))
+
+    def with_line_totals(self):
+        lines = line_total_expressions()
+        return self.annotate(
+            line_total_price=lines['total_price'],
+            line_amount_saved=lines['amount_saved'],
+            line_final_price=lines['final_price'],
+        )
+
+
+class OrderQuerySet(models.QuerySet):
+    def active_cart_for(self, user):
+        """
+        The user's open order with its items, their catalog rows and the
+        per-line totals loaded up front: two queries whatever the cart size.
+        """
+        items = OrderItem.objects.select_related(
+            'item').with_line_totals().order_by('pk')
+        return self.prefetch_related(Prefetch('items', queryset=items)).get(
+            user=user, ordered=False)
+
+    def update_totals(self):
+        """Order.update_totals() for every order, in a single UPDATE."""
+        lines = line_total_expressions('orderitem__')
+        order_lines = Order.items.through.objects.filter(order=OuterRef('pk')).values('order')
+        return self.update(
+            total=Coalesce(Subquery(order_lines.annotate(
+                total=Sum(lines['final_price'])).values('total')), 0.0),
+            item_count=Coalesce(Subquery(order_lines.annotate(
+                count=Count('pk')).values('count')), 0),
+            updated=timezone.now(),
+        )
+
+    def place(self):
+        """
+        Checks out the open orders among these at the prices of the moment,
+        like the checkout does for one, in a fixed number of UPDATEs.
+        Skips the Order and OrderItem signals. Returns the (id, user id) of
+        the orders placed.
+        """
+        orders = list(self.filter(ordered=False).values_list('pk', 'user_id'))
+        ids = [pk for pk, user_id in orders]
+        if ids:
+            lines = OrderItem.objects.filter(order__in=ids)
+            lines.snapshot_prices()
+            Order.objects.filter(pk__in=ids).update_totals()
+            lines.update(ordered=True)
+            now = timezone.now()
+            Order.objects.filter(pk__in=ids).update(ordered=True, ordered_date=now, updated=now)
+        return orders
+
+
 class OrderItem(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
                              on_delete=models.CASCADE, blank=True, null=True)
     item = models.ForeignKey(Item, on_delete=models.CASCADE)
     quantity = models.IntegerField(default=1)
     ordered = models.BooleanField(default=False)
+    # the item's prices when the line was added, kept in step while the cart
+    # is open (see snapshot_prices()) and frozen once it is checked out
+    price = models.FloatField()
+    discount_price = models.FloatField(blank=True, null=True)
+
+    objects = OrderItemQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # a user has a single open line per item, so adding to the cart
+            # can't race into duplicates
+            models.UniqueConstraint(fields=['user', 'item'], condition=Q(ordered=False),
+                                    name='core_orderitem_one_open_line'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.price is None:
+            self.price, self.discount_price = self.item.price, self.item.discount_price
+        super(OrderItem, self).save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.quantity} of {self.item.title}"
 
     def get_item_total_price(self):
-        return self.quantity * self.item.price
+        return self.quantity * self.price
 
     def get_item_total_discount_price(self):
-        return self.quantity * self.item.discount_price
+        return self.quantity * self.discount_price
 
     # how much money saved
     def get_amount_saved(self):
@@ -66,7 +195,7 @@ class OrderItem(models.Model):
 
     # Final Order Price
     def get_final_price(self):
-        if self.item.discount_price:
+        if self.discount_price:
             return self.get_item_total_discount_price()
         else:
             return self.get_item_total_price()
@@ -77,20 +206,59 @@ class Order(models.Model):
                              on_delete=models.CASCADE)
     items = models.ManyToManyField(OrderItem)
     start_date = models.DateTimeField(auto_now_add=True)
+    # last change to the cart, idle carts are purged by purge_carts
+    updated = models.DateTimeField(auto_now=True)
     ordered_date = models.DateTimeField()
     ordered = models.BooleanField(default=False)
     billing_address = models.ForeignKey(
         'BillingAddress', on_delete=models.SET_NULL, blank=True, null=True)
+    # stored copies of get_totals(), kept up to date by update_totals()
+    total = models.FloatField(default=0)
+    item_count = models.IntegerField(default=0)
+    # set once refresh_recommendations has counted the order's item pairs
+    pairs_counted = models.BooleanField(default=False)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # every cart lookup filters on (user, ordered=False)
+            models.Index(fields=['user', 'ordered'], name='core_order_user_ordered_idx'),
+            models.Index(fields=['ordered', 'updated'], name='core_order_idle_idx'),
+            # the orders refresh_recommendations has yet to count
+            models.Index(fields=['id'], condition=Q(ordered=True, pairs_counted=False),
+                         name='core_order_uncounted_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user'], condition=Q(ordered=False),
+                                    name='core_order_one_open_cart'),
+        ]
 
     def __str__(self):
         return self.user.username
 
+    # Totals of all the order items, computed in a single query
+    def get_totals(self):
+        lines = line_total_expressions()
+        totals = self.items.aggregate(
+            total_price=Sum(lines['total_price']),
+            amount_saved=Sum(lines['amount_saved']),
+            total=Sum(lines['final_price']),
+            item_count=Count('pk'),
+        )
+        for key in ('total_price', 'amount_saved', 'total'):
+            totals[key] = totals[key] or 0
+        return totals
+
     # Get Final Total
     def get_total(self):
-        total = 0
-        for order_item in self.items.all():
-            total += order_item.get_final_price()
-        return total
+        return self.get_totals()['total']
+
+    def update_totals(self):
+        totals = self.get_totals()
+        self.total = totals['total']
+        self.item_count = totals['item_count']
+        self.save(update_fields=['total', 'item_count', 'updated'])
 
 
 class BillingAddress(models.Model):
@@ -103,3 +271,71 @@ class BillingAddress(models.Model):
 
     def __str__(self):
         return self.user.username
+
+
+# Completed orders older than a few months are moved here by the
+# archive_orders command, so Order and OrderItem only hold open carts and
+# recent orders. A line keeps what the item was sold for.
+
+
+class ArchivedOrder(models.Model):
+    # the id the order had while it was live
+    id = models.IntegerField(primary_key=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL,
+                             on_delete=models.CASCADE)
+    start_date = models.DateTimeField()
+    ordered_date = models.DateTimeField()
+    billing_address = models.ForeignKey(
+        'BillingAddress', on_delete=models.SET_NULL, blank=True, null=True)
+    total = models.FloatField(default=0)
+    item_count = models.IntegerField(default=0)
+    archived_date = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'ordered_date'], name='core_archivedorder_user_idx'),
+        ]
+
+    def __str__(self):
+        return self.user.username
+
+
+class ArchivedOrderLine(models.Model):
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name='lines')
+    item = models.ForeignKey(Item, on_delete=models.SET_NULL, blank=True, null=True)
+    title = models.CharField(max_length=100)
+    quantity = models.IntegerField(default=1)
+    price = models.FloatField()
+    discount_price = models.FloatField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.quantity} of {self.title}"
+
+    def get_final_price(self):
+        if self.discount_price:
+            return self.quantity * self.discount_price
+        return self.quantity * self.price
+
+
+# How often two items were bought in the same order, both ways round:
+# a sparse item to item matrix kept up to date by refresh_recommendations.
+
+
+class ItemPair(models.Model):
+    # looked up through the unique (item, other) index, no index of its own
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='pairs',
+                             db_index=False)
+    other = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='+')
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['item', 'other'], name='core_itempair_unique'),
+        ]
+        indexes = [
+            # an item's strongest neighbours
+            models.Index(fields=['item', '-count'], name='core_itempair_item_count_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.item_id} and {self.other_id}: {self.count}"
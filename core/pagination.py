@@ -0,0 +1,184 @@
+import base64
+import binascii
+import json
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.http import Http404
+from django.utils.functional import cached_property
+
+NEXT, PREVIOUS = 'n', 'p'
+
+
+def encode_cursor(direction, number, values):
+    data = json.dumps([direction, number, values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, number, values = json.loads(data.decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        raise Http404('Invalid cursor')
+    if (direction not in (NEXT, PREVIOUS) or not isinstance(number, int) or
+            not isinstance(values, list)):
+        raise Http404('Invalid cursor')
+    return direction, number, values
+
+
+class KeysetPage:
+    def __init__(self, object_list, number, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.number = number
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Seeks to a page with a WHERE clause on the ordering key instead of an
+    OFFSET, so any page costs the same as the first one, and never counts
+    the rows. `ordering` must end in a unique field, e.g. ('id',) or
+    ('-rank', 'id'); pages are addressed by opaque cursors.
+    """
+
+    def __init__(self, object_list, per_page, ordering):
+        self.object_list = object_list
+        self.per_page = per_page
+        self.ordering = [(field.lstrip('-'), field.startswith('-')) for field in ordering]
+
+    def seek(self, values, backwards):
+        condition = Q()
+        equal = Q()
+        for (field, descending), value in zip(self.ordering, values):
+            lookup = 'lt' if descending != backwards else 'gt'
+            condition |= equal & Q(**{f'{field}__{lookup}': value})
+            equal &= Q(**{field: value})
+        return condition
+
+    def order_by(self, backwards):
+        return ['-' + field if descending != backwards else field
+                for field, descending in self.ordering]
+
+    def key(self, obj):
+        return [getattr(obj, field) for field, descending in self.ordering]
+
+    def page(self, cursor=None):
+        direction, number, values = decode_cursor(cursor) if cursor else (NEXT, 1, None)
+        backwards = direction == PREVIOUS
+        queryset = self.object_list.order_by(*self.order_by(backwards))
+        if values is not None:
+            if len(values) != len(self.ordering):
+                raise Http404('Invalid cursor')
+            try:
+                queryset = queryset.filter(self.seek(values, backwards))
+            except (TypeError, ValueError, ValidationError):
+                # values of the wrong type for their fields
+                raise Http404('Invalid cursor')
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+        number = max(number, 1) if has_previous else 1
+        next_cursor = previous_cursor = None
+        if rows and has_next:
+            next_cursor = encode_cursor(NEXT, number + 1, self.key(rows[-1]))
+        if rows and has_previous:
+            previous_cursor = encode_cursor(PREVIOUS, number - 1, self.key(rows[0]))
+        return KeysetPage(rows, number, next_cursor, previous_cursor)
+
+
+class KeysetPaginationMixin:
+    """
+    ListView mixin that paginates with KeysetPaginator. The page object also
+    carries ready-made `next_querystring` / `previous_querystring` values
+    that keep the other GET parameters, such as the search query.
+    """
+    cursor_kwarg = 'cursor'
+    keyset_ordering = ('id',)
+
+    def get_keyset_ordering(self):
+        return self.keyset_ordering
+
+    def cursor_querystring(self, cursor):
+        if cursor is None:
+            return None
+        params = self.request.GET.copy()
+        params[self.cursor_kwarg] = cursor
+        return params.urlencode()
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = KeysetPaginator(queryset, page_size, self.get_keyset_ordering())
+        page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        return self.paginated(paginator, page)
+
+    def paginated(self, paginator, page):
+        page.next_querystring = self.cursor_querystring(page.next_cursor)
+        page.previous_querystring = self.cursor_querystring(page.previous_cursor)
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+
+def estimated_row_count(model, using='default'):
+    """
+    The number of rows in the model's table according to the planner
+    statistics (PostgreSQL's pg_class, SQLite's sqlite_stat1 once ANALYZE
+    has run), or None when there are none.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = to_regclass(%s)',
+                           [connection.ops.quote_name(table)])
+            row = cursor.fetchone()
+            # -1 for a table never vacuumed or analyzed
+            return int(row[0]) if row and row[0] >= 0 else None
+        if connection.vendor == 'sqlite':
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            # every index's stat starts with the number of rows
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s', [table])
+            counts = [int(stat.split()[0]) for stat, in cursor.fetchall()]
+            return max(counts) if counts else None
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for admin changelists over large tables. A whole table is
+    counted from the planner statistics instead of a COUNT(*) that reads
+    every row, once they put it at `exact_count_below` rows or more; a
+    filtered list, which the statistics can't count, is counted exactly.
+    """
+    exact_count_below = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if hasattr(queryset, 'query') and not queryset.query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= self.exact_count_below:
+                return estimate
+        return super().count
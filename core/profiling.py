@@ -0,0 +1,110 @@
+"""
+Where request time goes: SQL, template rendering and the view, per request
+and as rolling per-URL-name statistics kept in this process.
+"""
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from django.template.backends.django import Template
+
+# milliseconds, the upper bounds of the histogram buckets
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+# requests kept per URL name
+WINDOW = 1000
+
+current = ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.template = 0.0
+        # templates being rendered, counting those rendered by another one
+        self.rendering = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        # a connection.execute_wrapper() timing every query
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - started
+            self.queries += 1
+
+
+def percentile(timings, pct):
+    return timings[min(len(timings) - 1, int(len(timings) * pct / 100))]
+
+
+class ViewStats:
+    """The last WINDOW requests of every URL name."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def record(self, name, total, view, db, template, queries):
+        with self.lock:
+            if name not in self.views:
+                self.views[name] = {'count': 0, 'window': deque(maxlen=WINDOW)}
+            stats = self.views[name]
+            stats['count'] += 1
+            stats['window'].append((total, view, db, template, queries))
+
+    def reset(self):
+        with self.lock:
+            self.views = {}
+
+    def snapshot(self):
+        with self.lock:
+            views = {name: (stats['count'], list(stats['window']))
+                     for name, stats in self.views.items()}
+        return {name: self.summarize(count, window) for name, (count, window) in views.items()}
+
+    def summarize(self, count, window):
+        totals = sorted(row[0] for row in window)
+        histogram = [0] * (len(BUCKETS) + 1)
+        for total in totals:
+            histogram[next((n for n, bound in enumerate(BUCKETS) if total <= bound),
+                           len(BUCKETS))] += 1
+        summary = {'count': count, 'window': len(window),
+                   'p50': percentile(totals, 50), 'p95': percentile(totals, 95),
+                   'p99': percentile(totals, 99), 'max': totals[-1],
+                   'histogram': dict(zip([f'le_{bound}' for bound in BUCKETS] + ['inf'],
+                                         histogram))}
+        for n, name in enumerate(['total', 'view', 'db', 'template', 'queries']):
+            summary[f'mean_{name}'] = sum(row[n] for row in window) / len(window)
+        return summary
+
+
+view_stats = ViewStats()
+
+
+def install_template_timer():
+    """
+    Times the Django template backend's Template.render, which every
+    render_to_string(), render() and TemplateResponse goes through.
+    Queries run while rendering count towards both db and template. A
+    template rendered while another one is (the item_cards tag rendering
+    the cards) is part of the outer one's time, so only that is counted.
+    """
+    render = Template.render
+    if getattr(render, 'timed', False):
+        return
+
+    def timed_render(self, context=None, request=None):
+        timings = current.get()
+        if timings is None or timings.rendering:
+            return render(self, context, request)
+        timings.rendering += 1
+        started = time.perf_counter()
+        try:
+            return render(self, context, request)
+        finally:
+            timings.template += time.perf_counter() - started
+            timings.rendering -= 1
+
+    timed_render.timed = True
+    Template.render = timed_render
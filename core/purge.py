@@ -0,0 +1,100 @@
+"""
+Deletes carts nobody touched for a while and the OrderItem rows no order
+refers to any more (remove_from_cart only detaches a line from its cart).
+
+Rows go a batch per short transaction, so the cart tables are never locked
+for long and an interrupted purge loses nothing but its remaining batches.
+"""
+from datetime import timedelta
+from django.db import connection, transaction
+from django.utils import timezone
+from .catalog import LOOKUP_BATCH, chunked
+from .models import Order, OrderItem
+
+OrderLine = Order.items.through
+
+
+def delete_orphan_items(ids):
+    """
+    Deletes the open OrderItem rows among ids that are in no order,
+    checked in the DELETE itself so a line re-attached meanwhile stays.
+    Skips OrderItem's delete signals, which only matter for lines in an
+    order. Returns the number of rows deleted.
+    """
+    quote = connection.ops.quote_name
+    table = quote(OrderItem._meta.db_table)
+    pk = quote(OrderItem._meta.pk.column)
+    sql = ('DELETE FROM {table} WHERE {pk} IN ({ids}) AND {ordered} = %s AND NOT EXISTS ('
+           'SELECT 1 FROM {lines} WHERE {lines}.{orderitem} = {table}.{pk})')
+    deleted = 0
+    with connection.cursor() as cursor:
+        for chunk in chunked(ids, LOOKUP_BATCH):
+            cursor.execute(sql.format(
+                table=table, pk=pk, ids=', '.join(['%s'] * len(chunk)),
+                ordered=quote(OrderItem._meta.get_field('ordered').column),
+                lines=quote(OrderLine._meta.db_table),
+                orderitem=quote(OrderLine._meta.get_field('orderitem').column),
+            ), chunk + [False])
+            deleted += cursor.rowcount
+    return deleted
+
+
+def purge_idle_carts_batch(cutoff, batch_size):
+    """
+    Deletes up to batch_size open orders unchanged since cutoff with their
+    lines. Returns (orders, order items) deleted.
+    """
+    with transaction.atomic():
+        # locked like every cart change, so a cart being used now waits
+        # for this batch or is no longer idle once it gets the lock
+        ids = list(Order.objects.select_for_update().filter(
+            ordered=False, updated__lt=cutoff).order_by('pk').values_list(
+            'pk', flat=True)[:batch_size])
+        if not ids:
+            return 0, 0
+        item_ids = list(OrderLine.objects.filter(order__in=ids).values_list(
+            'orderitem_id', flat=True))
+        OrderLine.objects.filter(order__in=ids).delete()
+        items = delete_orphan_items(item_ids)
+        Order.objects.filter(pk__in=ids).delete()
+    return len(ids), items
+
+
+def purge_orphan_items_batch(after, batch_size):
+    """
+    Deletes the orphaned open lines among the next batch_size ids above
+    `after`. Returns (order items deleted, last id looked at).
+    """
+    ids = list(OrderItem.objects.filter(
+        pk__gt=after, ordered=False, order__isnull=True).order_by('pk').values_list(
+        'pk', flat=True)[:batch_size])
+    if not ids:
+        return 0, None
+    with transaction.atomic():
+        return delete_orphan_items(ids), ids[-1]
+
+
+def purge_carts(days, batch_size=500, progress=None):
+    """
+    Deletes the carts idle for more than `days` days, then every orphaned
+    OrderItem. Returns (carts, order items) deleted.
+    """
+    cutoff = timezone.now() - timedelta(days=days)
+    carts = items = 0
+    while True:
+        orders, lines = purge_idle_carts_batch(cutoff, batch_size)
+        if not orders:
+            break
+        carts += orders
+        items += lines
+        if progress:
+            progress(carts, items)
+    last = 0
+    while True:
+        deleted, last = purge_orphan_items_batch(last, batch_size)
+        if last is None:
+            break
+        items += deleted
+        if progress:
+            progress(carts, items)
+    return carts, items
@@ -0,0 +1,131 @@
+import re
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from .models import Item
+
+FTS_TABLE = 'core_item_fts'
+ITEM_DOCUMENT = ("coalesce(title, '') || ' ' || coalesce(description, '') || ' ' || "
+                 "coalesce(category, '')")
+ITEM_TSVECTOR = f"to_tsvector('english', {ITEM_DOCUMENT})"
+
+
+def search_terms(query):
+    return re.findall(r'\w+', query or '')
+
+
+class SearchBackend:
+    """
+    Full-text search over the item title, description and category.
+    search() returns an Item queryset ordered by relevance, with the
+    score available as the `rank` annotation.
+    """
+    ordering = ('id',)
+
+    def search(self, queryset, query):
+        raise NotImplementedError
+
+    def index(self, item):
+        pass
+
+    def remove(self, item_id):
+        pass
+
+    def rebuild(self):
+        pass
+
+
+class SimpleSearchBackend(SearchBackend):
+    """Unindexed LIKE scan, for databases without a full-text engine."""
+
+    def search(self, queryset, query):
+        terms = search_terms(query)
+        if not terms:
+            return queryset.none()
+        for term in terms:
+            queryset = queryset.filter(
+                Q(title__icontains=term) | Q(description__icontains=term) |
+                Q(category__icontains=term))
+        return queryset.annotate(rank=Value(0.0, output_field=FloatField())).order_by(*self.ordering)
+
+
+class SQLiteSearchBackend(SearchBackend):
+    """
+    FTS5 index in the core_item_fts virtual table, ranked with bm25()
+    (lower is better). The table is kept in sync from the Item signals.
+    """
+    ordering = ('rank', 'id')
+
+    def match_expression(self, query):
+        # every term is quoted, so user input can't inject FTS5 syntax
+        return ' '.join('"%s"*' % term for term in search_terms(query))
+
+    def search(self, queryset, query):
+        match = self.match_expression(query)
+        if not match:
+            return queryset.none()
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = {Item._meta.db_table}.id',
+                   f'{FTS_TABLE} MATCH %s'],
+            params=[match],
+        ).annotate(
+            rank=RawSQL(f'bm25({FTS_TABLE})', (), output_field=FloatField())
+        ).order_by(*self.ordering)
+
+    def index(self, item):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [item.pk])
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, title, description, category) '
+                'VALUES (%s, %s, %s, %s)',
+                [item.pk, item.title, item.description, item.category])
+
+    def remove(self, item_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [item_id])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, title, description, category) '
+                f'SELECT id, title, description, category FROM {Item._meta.db_table}')
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    tsvector search backed by the core_item_search_idx GIN expression index,
+    ranked with ts_rank() (higher is better). The index is maintained by
+    PostgreSQL itself, so there is nothing to sync.
+    """
+    ordering = ('-rank', 'id')
+
+    def ts_query(self, query):
+        return ' & '.join('%s:*' % term for term in search_terms(query))
+
+    def search(self, queryset, query):
+        ts_query = self.ts_query(query)
+        if not ts_query:
+            return queryset.none()
+        return queryset.extra(
+            where=[f"{ITEM_TSVECTOR} @@ to_tsquery('english', %s)"],
+            params=[ts_query],
+        ).annotate(rank=RawSQL(
+            f"ts_rank({ITEM_TSVECTOR}, to_tsquery('english', %s))", (ts_query,),
+            output_field=FloatField(),
+        )).order_by(*self.ordering)
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+_backends = {}
+
+
+def get_search_backend():
+    vendor = connection.vendor
+    if vendor not in _backends:
+        _backends[vendor] = BACKENDS.get(vendor, SimpleSearchBackend)()
+    return _backends[vendor]
@@ -0,0 +1,102 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from . import cart
+from .caching import bump_product_versions, clear_cart_count, set_cart_count
+from .facets import item_facets, update_facet_index
+from .models import Item, OrderItem, Order
+from .search import get_search_backend
+
+
+# Keep the stored Order.total / Order.item_count in step with the cart
+
+@receiver(m2m_changed, sender=Order.items.through)
+def order_items_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        orders = Order.objects.filter(pk__in=pk_set or ())
+    else:
+        orders = [instance]
+    for order in orders:
+        order.update_totals()
+
+
+@receiver(post_save, sender=OrderItem)
+def order_item_saved(sender, instance, created, **kwargs):
+    if created:
+        # a new order item only counts once it is added to an order
+        return
+    for order in instance.order_set.all():
+        order.update_totals()
+
+
+@receiver(pre_delete, sender=OrderItem)
+def order_item_deleting(sender, instance, **kwargs):
+    instance._order_ids = list(instance.order_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=OrderItem)
+def order_item_deleted(sender, instance, **kwargs):
+    for order in Order.objects.filter(pk__in=getattr(instance, '_order_ids', ())):
+        order.update_totals()
+
+
+@receiver(pre_save, sender=Item)
+def item_saving(sender, instance, **kwargs):
+    instance._previous_slug = None
+    if instance.pk:
+        instance._previous_slug = Item.objects.filter(
+            pk=instance.pk).values_list('slug', flat=True).first()
+
+
+@receiver(post_save, sender=Item)
+def item_saved(sender, instance, created, **kwargs):
+    get_search_backend().index(instance)
+    update_facet_index(instance.pk, item_facets(
+        instance.category, instance.label, instance.price, instance.discount_price))
+    slugs = {instance.slug, getattr(instance, '_previous_slug', None)} - {None}
+    # only once committed: a page rendered before that reads the old row
+    transaction.on_commit(lambda: bump_product_versions(slugs))
+    if created:
+        return
+    # open carts follow the item's price, and their totals move with it
+    OrderItem.objects.filter(item=instance, order__ordered=False).update(
+        price=instance.price, discount_price=instance.discount_price)
+    Order.objects.filter(ordered=False, items__item=instance).update_totals()
+
+
+@receiver(post_delete, sender=Item)
+def item_deleted(sender, instance, **kwargs):
+    get_search_backend().remove(instance.pk)
+    update_facet_index(instance.pk)
+    transaction.on_commit(lambda: bump_product_versions([instance.slug]))
+
+
+# Keep the cached navbar cart count in step with the stored one
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance, **kwargs):
+    # once committed, so a rolled back change leaves the count alone
+    user_id, count = instance.user_id, instance.item_count
+    if instance.ordered:
+        transaction.on_commit(lambda: clear_cart_count(user_id))
+    else:
+        transaction.on_commit(lambda: set_cart_count(user_id, count))
+
+
+@receiver(post_delete, sender=Order)
+def order_deleted(sender, instance, **kwargs):
+    user_id = instance.user_id
+    transaction.on_commit(lambda: clear_cart_count(user_id))
+
+
+# Hand the cart built while browsing anonymously over to the user
+
+@receiver(user_logged_in)
+def merge_cookie_cart(sender, request, user, **kwargs):
+    cookie_cart = getattr(request, 'cookie_cart', None)
+    if cookie_cart:
+        cart.merge_items(user, cookie_cart.quantities)
+        cookie_cart.clear()
@@ -0,0 +1,127 @@
+"""
+Static files storage for production: content-hashed names that can be
+cached forever, minified CSS and JS, and gzip/brotli variants of every
+compressible file, all built by collectstatic. Minification and brotli are
+skipped when rcssmin/rjsmin or Brotli are not installed.
+"""
+import gzip
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.txt', '.html', '.xml',
+                           '.eot', '.ttf', '.otf', '.map')
+# smaller files gain nothing from compression
+COMPRESS_MIN_SIZE = 256
+
+
+def minify(name, content):
+    if name.endswith('.min.css') or name.endswith('.min.js'):
+        return content
+    if name.endswith('.css') and rcssmin:
+        return rcssmin.cssmin(content)
+    if name.endswith('.js') and rjsmin:
+        return rjsmin.jsmin(content)
+    return content
+
+
+class MinifyingSource:
+    """A collectstatic source storage whose CSS and JS files open minified."""
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def open(self, path, mode='rb'):
+        with self.storage.open(path, mode) as source:
+            content = source.read()
+        minified = minify(path, content.decode('utf-8'))
+        return ContentFile(minified.encode('utf-8'))
+
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+
+
+class StaticPipelineMixin:
+    """
+    For a ManifestFilesMixin storage. Minifies CSS and JS before they are
+    hashed and writes .gz and .br variants next to the hashed files.
+
+    A hashed name stands for its content, so a hashed file that already
+    exists is never written again: the manifest storage deletes and
+    re-saves adjustable files (CSS) on every run, which is deferred here
+    and skipped when the same name is saved again. A repeated collectstatic
+    then only writes files that changed.
+    """
+    minify = True
+    compress = True
+
+    def post_process(self, paths, dry_run=False, **options):
+        if self.minify and not dry_run:
+            paths = {name: (MinifyingSource(storage), path) if name.endswith(('.css', '.js'))
+                     else (storage, path)
+                     for name, (storage, path) in paths.items()}
+        self.deferred_deletes = set()
+        try:
+            yield from super().post_process(paths, dry_run=dry_run, **options)
+        finally:
+            deferred, self.deferred_deletes = self.deferred_deletes, None
+            for name in deferred:
+                super().delete(name)
+        if self.compress and not dry_run:
+            for name in sorted(set(self.hashed_files.values())):
+                for variant in self.compress_file(name):
+                    yield name, variant, True
+
+    def delete(self, name):
+        if getattr(self, 'deferred_deletes', None) is not None and name != self.manifest_name:
+            self.deferred_deletes.add(name)
+        else:
+            super().delete(name)
+
+    def _save(self, name, content):
+        deferred = getattr(self, 'deferred_deletes', None)
+        if deferred and name in deferred:
+            # the same content is already stored under this name
+            deferred.discard(name)
+            return name
+        return super()._save(name, content)
+
+    def compress_file(self, name):
+        if not name.endswith(COMPRESSIBLE_EXTENSIONS):
+            return
+        compressors = [('.gz', lambda content: gzip.compress(content, 9, mtime=0))]
+        if brotli:
+            compressors.append(('.br', lambda content: brotli.compress(content)))
+        content = None
+        for extension, compress in compressors:
+            variant = name + extension
+            if self.exists(variant):
+                continue
+            if content is None:
+                with self.open(name) as original:
+                    content = original.read()
+                if len(content) < COMPRESS_MIN_SIZE:
+                    return
+            compressed = compress(content)
+            # only worth serving when it saves at least 5%
+            if len(compressed) < len(content) * 0.95:
+                self._save(variant, ContentFile(compressed))
+                yield variant
+
+
+class CompressedManifestStaticFilesStorage(StaticPipelineMixin, ManifestStaticFilesStorage):
+    pass
@@ -1,3 +1,1049 @@
-from django.test import TestCase
+import asyncio
+import io
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.template import engines
+from django.db import OperationalError, connection, connections, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from . import cart
+from .management.commands.benchmark_views import find_regressions
+from .analytics import SalesReport
+from .archive import archive_orders
+from .caching import cart_count_key, get_product_version
+from .facets import FacetIndex, item_facets, popcount
+from . import recommendations
+from .purge import purge_carts
+from .models import ArchivedOrder, Item, ItemPair, OrderItem, Order
+from .pagination import NEXT, EstimatedCountPaginator, KeysetPaginator, encode_cursor
+from . import profiling
+from .profiling import view_stats
+from djecommerce.asgi_handler import PooledASGIHandler
+from djecommerce.db.pool import ConnectionPool, PoolTimeout
+from djecommerce.static_handler import ASGIStaticFilesHandler, StaticFilesHandler
+from .search import get_search_backend
 
-# Create your tests here.
+# "SCAN core_order" in an SQLite plan is a full table scan, virtual (FTS)
+# tables excepted
+FULL_SCAN = re.compile(r'SCAN (?:TABLE )?(\w+)( VIRTUAL TABLE)?')
+
+
+class ViewQueryTests(TestCase):
+    """
+    Pins the number of queries every view in core/urls.py runs and checks
+    that none of them scans a whole table, so an N+1 or a missing index is
+    caught before it is deployed.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('shopper', password='secret')
+        cls.items = [
+            Item.objects.create(title=f'Shirt {n}', price=10, discount_price=8 if n % 2 else None,
+                                description='Soft cotton shirt', category='shirt', label='P')
+            for n in range(3)
+        ]
+        cls.order = Order.objects.create(user=cls.user, ordered_date=timezone.now())
+        for item in cls.items[:2]:
+            cls.order.items.add(OrderItem.objects.create(user=cls.user, item=item, quantity=2))
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def assertViewQueries(self, expected, url, method='get', data=None, allowed_scans=()):
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(url, data)
+        queries = [query['sql'] for query in context.captured_queries]
+        self.assertEqual(len(queries), expected, '\n'.join(queries))
+        self.assertIndexedPlans(queries, allowed_scans)
+        return response
+
+    def assertIndexedPlans(self, queries, allowed_scans=()):
+        if connection.vendor != 'sqlite':
+            return
+        for sql in queries:
+            if not sql.startswith('SELECT'):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                plan = [row[-1] for row in cursor.fetchall()]
+            for step in plan:
+                match = FULL_SCAN.match(step)
+                if match and not match.group(2) and match.group(1) not in allowed_scans:
+                    self.fail(f'{match.group(1)} is scanned by: {sql}')
+
+    def test_home(self):
+        # the first page reads the table in id order and stops at the page size
+        response = self.assertViewQueries(4, reverse('core:home'), allowed_scans={'core_item'})
+        self.assertEqual(len(response.context['object_list']), 3)
+
+    def test_home_next_page(self):
+        for n in range(12):
+            Item.objects.create(title=f'Extra {n}', price=5, description='Extra',
+                                category='outweare', label='S')
+        page = self.client.get(reverse('core:home')).context['page_obj']
+        cache.clear()
+        response = self.assertViewQueries(
+            4, reverse('core:home') + '?' + page.next_querystring)
+        self.assertEqual(response.context['page_obj'].number, 2)
+
+    def test_item_category(self):
+        self.assertViewQueries(4, reverse('core:item_category', args=['shirt']))
+
+    def test_item_search(self):
+        response = self.assertViewQueries(4, reverse('core:item_search') + '?query=shirt')
+        self.assertEqual(len(response.context['object_list']), 3)
+
+    def test_product(self):
+        # the item and its recommendations, both cached afterwards
+        self.assertViewQueries(5, reverse('core:product', args=[self.items[0].slug]))
+
+    def test_product_page_cache(self):
+        url = reverse('core:product', args=[self.items[0].slug])
+        self.client.get(url)
+        # only the session, the user and nothing else: the badge and the
+        # product markup both come from the cache
+        self.assertViewQueries(2, url)
+
+    def test_item_card_cache(self):
+        url = reverse('core:home')
+        self.client.get(url)
+        with self.assertTemplateNotUsed('pages/card.html'):
+            response = self.client.get(url)
+        self.assertContains(response, self.items[1].get_absolute_url(), count=2)
+        # an item changed behind the cache's back still shows its new price
+        Item.objects.filter(pk=self.items[0].pk).update(price=12.5)
+        with self.assertTemplateUsed('pages/card.html'):
+            self.assertContains(self.client.get(url), '<strong>12.5$</strong>')
+
+    def test_item_facets(self):
+        url = reverse('core:item_facets')
+        self.client.get(url)
+        # the session, the user and the page of items: the cart badge and
+        # the facet index come from the cache
+        response = self.assertViewQueries(3, url + '?category=shirt&sale=1&price=0-25')
+        self.assertEqual([item.pk for item in response.context['object_list']],
+                         [self.items[1].pk])
+        facets = response.context['facets']
+        self.assertEqual(facets['sale'], [('1', 'On sale', 1, True)])
+        self.assertEqual(facets['category'][0], ('shirt', 'SHIRT', 1, True))
+        self.assertEqual(facets['price'][0], ('0-25', 'Under $25', 1, True))
+
+    def test_order_summery(self):
+        response = self.assertViewQueries(5, reverse('core:order-summery'))
+        self.assertContains(response, '$ <span id="order-total">36.0</span>')
+
+    def test_add_to_cart(self):
+        self.assertViewQueries(9, reverse('core:add-to-cart', args=[self.items[0].slug]))
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.item_count, self.order.total), (2, 46.0))
+
+    def test_add_new_item_to_cart(self):
+        self.assertViewQueries(13, reverse('core:add-to-cart', args=[self.items[2].slug]))
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.item_count, self.order.total), (3, 46.0))
+
+    def test_remove_from_cart(self):
+        self.assertViewQueries(9, reverse('core:remove-from-cart', args=[self.items[0].slug]))
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.item_count, self.order.total), (1, 16.0))
+
+    def test_remove_single_item(self):
+        self.assertViewQueries(9, reverse('core:remove-single-item', args=[self.items[0].slug]))
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.item_count, self.order.total), (2, 26.0))
+
+    def test_api_add_to_cart(self):
+        # against 9 for add_to_cart plus 5 for the order summary it redirects to
+        response = self.assertViewQueries(
+            10, reverse('core:api-add-to-cart', args=[self.items[0].slug]), method='post')
+        self.assertEqual(response.json(), {
+            'status': cart.UPDATED,
+            'line': {'slug': self.items[0].slug, 'quantity': 3, 'final_price': 30.0,
+                     'amount_saved': 0.0},
+            'total': 46.0, 'item_count': 2,
+        })
+
+    def test_api_remove_from_cart(self):
+        response = self.assertViewQueries(
+            10, reverse('core:api-remove-from-cart', args=[self.items[1].slug]), method='post')
+        self.assertEqual(response.json(), {
+            'status': cart.REMOVED, 'line': None, 'total': 20.0, 'item_count': 1,
+        })
+
+    def test_checkout(self):
+        self.assertViewQueries(4, reverse('core:checkout'))
+
+    def test_checkout_post(self):
+        # the session, user, cart, prices snapshot, totals, address and order
+        self.assertViewQueries(7, reverse('core:checkout'), method='post', data={
+            'street_address': '1234 Main St', 'country': 'BD', 'zip_code': '1000',
+            'payment_option': 'S',
+        })
+        self.order.refresh_from_db()
+        self.assertIsNotNone(self.order.billing_address)
+
+    def test_payment(self):
+        self.assertViewQueries(3, reverse('core:payment', args=['S']))
+
+
+class FacetIndexTests(SimpleTestCase):
+    def test_index(self):
+        index = FacetIndex()
+        for item_id in range(1, 31):
+            index.add(item_id, item_facets('shirt' if item_id % 3 else 'outweare', 'P',
+                                           item_id * 5, 4 if item_id % 2 else None))
+        selected = {'category': {'shirt'}, 'price': {'0-25', '100-'}}
+        self.assertEqual(popcount(index.match(selected)), 16)
+        counts = index.counts(selected)
+        # the counts of a facet ignore what is chosen in that facet
+        self.assertEqual(counts['category'], [('shirt', 'SHIRT', 16, True),
+                                              ('sportweare', 'SPORT WEARE', 0, False),
+                                              ('outweare', 'OUT WEARE', 7, False)])
+        self.assertEqual(counts['sale'], [('1', 'On sale', 10, False)])
+
+        # moving an item between facet values
+        index.remove(20)
+        index.add(20, item_facets('outweare', 'P', 100, None))
+        self.assertEqual(index.counts({})['category'][2][2], 11)
+
+        bits = index.match({'category': {'shirt'}})
+        first = index.page(bits, 12)
+        self.assertEqual(first.object_list, [1, 2, 4, 5, 7, 8, 10, 11, 13, 14, 16, 17])
+        second = index.page(bits, 12, first.next_cursor)
+        self.assertEqual(second.object_list, [19, 22, 23, 25, 26, 28, 29])
+        self.assertFalse(second.has_next())
+        self.assertEqual(index.page(bits, 12, second.previous_cursor).object_list,
+                         first.object_list)
+
+
+class OrderTotalsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('shopper', password='secret')
+        cls.shirt = Item.objects.create(title='Shirt', price=10, discount_price=8,
+                                        description='Shirt', category='shirt', label='P')
+        cls.coat = Item.objects.create(title='Coat', price=50, discount_price=0,
+                                       description='Coat', category='outweare', label='D')
+
+    def setUp(self):
+        self.order = Order.objects.create(user=self.user, ordered_date=timezone.now())
+        self.shirts = OrderItem.objects.create(user=self.user, item=self.shirt, quantity=3)
+        self.coats = OrderItem.objects.create(user=self.user, item=self.coat)
+
+    def stored(self):
+        order = Order.objects.get(pk=self.order.pk)
+        return order.total, order.item_count
+
+    def test_get_totals(self):
+        self.assertEqual(self.order.get_totals(), {
+            'total_price': 0, 'amount_saved': 0, 'total': 0, 'item_count': 0})
+        self.order.items.add(self.shirts, self.coats)
+        # a discount price of 0 is no discount
+        self.assertEqual(self.order.get_totals(), {
+            'total_price': 80.0, 'amount_saved': 6.0, 'total': 74.0, 'item_count': 2})
+        self.assertEqual(self.order.get_total(), 74.0)
+
+    def test_update_totals(self):
+        self.order.items.add(self.shirts)
+        Order.objects.filter(pk=self.order.pk).update(total=0, item_count=0)
+        self.order.update_totals()
+        self.assertEqual(self.stored(), (24.0, 1))
+        Order.objects.filter(pk=self.order.pk).update(total=0, item_count=0)
+        Order.objects.filter(pk=self.order.pk).update_totals()
+        self.assertEqual(self.stored(), (24.0, 1))
+
+    def test_receivers_keep_totals_in_step(self):
+        self.order.items.add(self.shirts, self.coats)
+        self.assertEqual(self.stored(), (74.0, 2))
+        self.shirts.quantity = 1
+        self.shirts.save()
+        self.assertEqual(self.stored(), (58.0, 2))
+        self.order.items.remove(self.coats)
+        self.assertEqual(self.stored(), (8.0, 1))
+        # and from the other side of the relation
+        self.coats.order_set.add(self.order)
+        self.assertEqual(self.stored(), (58.0, 2))
+        self.coats.delete()
+        self.assertEqual(self.stored(), (8.0, 1))
+        self.shirts.delete()
+        self.assertEqual(self.stored(), (0, 0))
+        self.order.items.add(OrderItem.objects.create(user=self.user, item=self.coat))
+        self.order.items.clear()
+        self.assertEqual(self.stored(), (0, 0))
+
+
+class SearchTests(TestCase):
+    def search(self, query):
+        return [item.title for item in get_search_backend().search(Item.objects.all(), query)]
+
+    def create(self, title, description):
+        return Item.objects.create(title=title, price=10, description=description,
+                                   category='outweare', label='P')
+
+    def test_index_follows_items(self):
+        item = self.create('Rain Coat', 'Waterproof coat')
+        self.assertEqual(self.search('waterproof'), ['Rain Coat'])
+        # terms are prefixes, and every term must match
+        self.assertEqual(self.search('water coa'), ['Rain Coat'])
+        self.assertEqual(self.search('waterproof scarf'), [])
+        item.description = 'Windproof coat'
+        item.save()
+        self.assertEqual(self.search('waterproof'), [])
+        self.assertEqual(self.search('windproof'), ['Rain Coat'])
+        item.delete()
+        self.assertEqual(self.search('windproof'), [])
+        # nothing to search for: no results rather than every item
+        self.assertEqual(self.search('" * -'), [])
+
+    def test_ranking(self):
+        self.create('Plain Tee', 'A cotton tee with a small wool label on the collar, '
+                                 'machine washable, in many colours and sizes')
+        self.create('Wool Scarf', 'Wool scarf')
+        self.create('Wool Hat', 'Warm wool hat, pure wool')
+        # the most matches in the shortest text first
+        self.assertEqual(self.search('wool'), ['Wool Hat', 'Wool Scarf', 'Plain Tee'])
+        response = self.client.get(reverse('core:item_search'), {'query': 'wool'})
+        self.assertEqual([item.title for item in response.context['object_list']],
+                         ['Wool Hat', 'Wool Scarf', 'Plain Tee'])
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.items = [Item.objects.create(title=f'Sock {n}', price=price, description='Sock',
+                                         category='shirt', label='S')
+                     for n, price in enumerate([10, 20, 10, 20, 10])]
+
+    def test_next_and_previous(self):
+        # equal prices are told apart by the id
+        paginator = KeysetPaginator(Item.objects.all(), 2, ('-price', 'id'))
+        expected = sorted(self.items, key=lambda item: (-item.price, item.pk))
+        pages = [paginator.page()]
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_cursor))
+        self.assertEqual([list(page) for page in pages],
+                         [expected[:2], expected[2:4], expected[4:]])
+        self.assertEqual([page.number for page in pages], [1, 2, 3])
+        self.assertFalse(pages[0].has_previous())
+        back = paginator.page(pages[2].previous_cursor)
+        self.assertEqual((list(back), back.number), (expected[2:4], 2))
+        back = paginator.page(back.previous_cursor)
+        self.assertEqual((list(back), back.number), (expected[:2], 1))
+        self.assertFalse(back.has_previous())
+
+    def test_invalid_cursor(self):
+        url = reverse('core:home')
+        for cursor in ['garbage', encode_cursor('x', 1, [1]), encode_cursor(NEXT, 2, [1, 2]),
+                       encode_cursor(NEXT, 2, ['abc']), encode_cursor(NEXT, 2, [None]),
+                       encode_cursor(NEXT, 2, [{'id': 1}])]:
+            self.assertEqual(self.client.get(url, {'cursor': cursor}).status_code, 404, cursor)
+        response = self.client.get(url, {'cursor': encode_cursor(NEXT, 2, [self.items[1].pk])})
+        self.assertEqual(response.status_code, 200)
+
+
+class ItemSlugTests(TestCase):
+    def test_duplicate_titles_get_unique_slugs(self):
+        slugs = [
+            Item.objects.create(title='Plain Tee', price=5, description='Tee',
+                                category='shirt', label='P').slug
+            for n in range(3)
+        ]
+        self.assertEqual(slugs, ['plain-tee', 'plain-tee-2', 'plain-tee-3'])
+
+
+class CatalogImportTests(TestCase):
+    def import_csv(self, content):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as csv_file:
+            csv_file.write(content)
+            csv_file.flush()
+            stdout, stderr = io.StringIO(), io.StringIO()
+            call_command('import_catalog', csv_file.name, batch_size=2,
+                         stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_import(self):
+        Item.objects.create(title='Plain Tee', price=5, description='Tee',
+                            category='shirt', label='P')
+        stdout, stderr = self.import_csv(
+            'title,price,discount_price,description,category,label,slug\n'
+            'Plain Tee,6,,Tee,shirt,P,\n'
+            'Plain Tee,7,5,Tee,shirt,P,\n'
+            'Plain Tee,8,,Tee,shirt,S,plain-tee\n'
+            'Rain Coat,abc,,Coat,outweare,D,\n'
+            'Rain Coat,40,,Waterproof coat,outweare,D,\n')
+        self.assertIn('5 rows', stdout)
+        self.assertIn('3 created, 1 updated, 1 invalid', stdout)
+        self.assertIn('line 5: price is not a number', stderr)
+        self.assertEqual(
+            list(Item.objects.order_by('pk').values_list('slug', 'price')),
+            [('plain-tee', 8.0), ('plain-tee-2', 6.0), ('plain-tee-3', 7.0),
+             ('rain-coat', 40.0)])
+        results = get_search_backend().search(Item.objects.all(), 'waterproof')
+        self.assertEqual([item.slug for item in results], ['rain-coat'])
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        view_stats.reset()
+
+    def test_server_timing_and_stats(self):
+        Item.objects.create(title='Scarf', price=5, description='Wool scarf',
+                            category='outweare', label='S')
+        response = self.client.get(reverse('core:home'))
+        self.assertRegex(response['Server-Timing'],
+                         r'^db;dur=[\d.]+;desc="1 queries", tpl;dur=[\d.]+, '
+                         r'view;dur=[\d.]+, total;dur=[\d.]+$')
+        stats_url = reverse('core:profiling-stats')
+        self.assertEqual(self.client.get(stats_url).status_code, 302)
+        staff = get_user_model().objects.create_user('staff', password='secret', is_staff=True)
+        self.client.force_login(staff)
+        stats = self.client.get(stats_url).json()['views']
+        self.assertEqual(stats['core:home']['count'], 1)
+        self.assertEqual(stats['core:home']['mean_queries'], 1)
+        self.assertEqual(sum(stats['core:home']['histogram'].values()), 1)
+        with override_settings(SERVER_TIMING=False):
+            self.assertNotIn('Server-Timing', self.client.get(reverse('core:home')))
+
+    def test_nested_templates_timed_once(self):
+        profiling.install_template_timer()
+
+        class Nested:
+            # a template rendering another, as the item_cards tag does
+            def __str__(self):
+                return inner.render({'slow': Slow()})
+
+        class Slow:
+            def __str__(self):
+                time.sleep(0.05)
+                return 'slow'
+
+        inner = engines['django'].from_string('{{ slow }}')
+        outer = engines['django'].from_string('{{ nested }}')
+        timings = profiling.RequestTimings()
+        token = profiling.current.set(timings)
+        try:
+            self.assertEqual(outer.render({'nested': Nested()}), 'slow')
+        finally:
+            profiling.current.reset(token)
+        self.assertLess(timings.template, 0.09)
+
+
+class StandInConnection:
+    def __init__(self):
+        self.closed = False
+        self.healthy = True
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def pool(self, **kwargs):
+        return ConnectionPool(StandInConnection, check=lambda connection: connection.healthy,
+                              **kwargs)
+
+    def test_connections_are_reused(self):
+        pool = self.pool(max_size=2)
+        first = pool.get()
+        pool.put(first)
+        self.assertIs(pool.get(), first)
+        second = pool.get()
+        self.assertIsNot(second, first)
+        stats = pool.get_stats()
+        self.assertEqual((stats['connects'], stats['checkouts'], stats['in_use']), (2, 3, 2))
+
+    def test_unhealthy_connection_is_replaced(self):
+        pool = self.pool(check_after=0)
+        connection = pool.get()
+        connection.healthy = False
+        pool.put(connection)
+        self.assertIsNot(pool.get(), connection)
+        self.assertTrue(connection.closed)
+        stats = pool.get_stats()
+        self.assertEqual((stats['failed_checks'], stats['reconnects']), (1, 1))
+
+    def test_waits_for_a_free_connection(self):
+        pool = self.pool(max_size=1, timeout=5)
+        connection = pool.get()
+        threading.Timer(0.05, pool.put, [connection]).start()
+        self.assertIs(pool.get(), connection)
+        self.assertEqual(pool.get_stats()['waits'], 1)
+
+        pool.timeout = 0.01
+        with self.assertRaises(PoolTimeout):
+            pool.get()
+        self.assertEqual(pool.get_stats()['timeouts'], 1)
+
+
+class StaticPipelineTests(SimpleTestCase):
+    def test_collectstatic(self):
+        with tempfile.TemporaryDirectory() as source, tempfile.TemporaryDirectory() as root:
+            with open(os.path.join(source, 'site.css'), 'w') as css:
+                css.write('body {\n    background: url("bg.svg");\n}\n' * 20)
+            with open(os.path.join(source, 'bg.svg'), 'w') as svg:
+                svg.write('<svg xmlns="http://www.w3.org/2000/svg"></svg>')
+            with override_settings(
+                    STATICFILES_DIRS=[source], STATIC_ROOT=root,
+                    STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder'],
+                    STATICFILES_STORAGE='core.storage.CompressedManifestStaticFilesStorage'):
+                call_command('collectstatic', interactive=False, verbosity=0)
+                files = set(os.listdir(root))
+                hashed_css = next(name for name in files if re.match(r'site\.\w{12}\.css$', name))
+                self.assertIn(hashed_css + '.gz', files)
+                with open(os.path.join(root, hashed_css)) as css:
+                    self.assertRegex(css.read(), r'url\("bg\.\w{12}\.svg"\)')
+                modified = {name: os.stat(os.path.join(root, name)).st_mtime_ns for name in files}
+                time.sleep(0.01)
+                call_command('collectstatic', interactive=False, verbosity=0)
+                # only the manifest is written again
+                self.assertEqual(
+                    [name for name in files
+                     if os.stat(os.path.join(root, name)).st_mtime_ns != modified[name]],
+                    ['staticfiles.json'])
+
+
+class StaticFilesHandlerTests(SimpleTestCase):
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        os.mkdir(os.path.join(root.name, 'css'))
+        self.content = b'body { color: red; }\n' * 100
+        with open(os.path.join(root.name, 'css', 'site.css'), 'wb') as css:
+            css.write(self.content)
+        with open(os.path.join(root.name, 'css', 'site.css.gz'), 'wb') as css:
+            css.write(b'gzipped')
+        self.root = root.name
+        self.handler = StaticFilesHandler(
+            lambda environ, start_response: start_response('200 OK', []) or [b'app'],
+            root.name, '/static/')
+
+    def get(self, path, **headers):
+        environ = dict(headers, REQUEST_METHOD='GET', PATH_INFO=path)
+        response = {}
+        body = self.handler(environ, lambda status, headers: response.update(
+            status=status, headers=dict(headers)))
+        response['body'] = b''.join(bytes(chunk) for chunk in body)
+        getattr(body, 'close', lambda: None)()
+        return response
+
+    def test_serves_precompressed_variant(self):
+        response = self.get('/static/css/site.css', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['status'], '200 OK')
+        self.assertEqual(response['body'], b'gzipped')
+        self.assertEqual(response['headers']['Content-Encoding'], 'gzip')
+        self.assertEqual(response['headers']['Vary'], 'Accept-Encoding')
+        self.assertEqual(self.get('/static/css/site.css')['body'], self.content)
+
+    def test_conditional_and_range_requests(self):
+        etag = self.get('/static/css/site.css')['headers']['ETag']
+        self.assertEqual(self.get('/static/css/site.css', HTTP_IF_NONE_MATCH=etag)['status'],
+                         '304 Not Modified')
+        response = self.get('/static/css/site.css', HTTP_RANGE='bytes=5-9')
+        self.assertEqual((response['status'], response['body']),
+                         ('206 Partial Content', self.content[5:10]))
+        self.assertEqual(response['headers']['Content-Range'],
+                         'bytes 5-9/%d' % len(self.content))
+        self.assertEqual(self.get('/static/css/site.css', HTTP_RANGE='bytes=99999-')['status'],
+                         '416 Range Not Satisfiable')
+
+    def test_close_with_last_block_held(self):
+        # gunicorn's workers still hold the last block when they close the body
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/static/css/site.css',
+                   'HTTP_RANGE': 'bytes=0-'}
+        body = self.handler(environ, lambda status, headers: None)
+        received = []
+        for item in body:
+            received.append(item)
+        body.close()
+        self.assertEqual(b''.join(received), self.content)
+        self.assertIsInstance(item, bytes)
+
+    def test_other_paths(self):
+        self.assertEqual(self.get('/static/missing.css')['status'], '404 Not Found')
+        self.assertEqual(self.get('/')['body'], b'app')
+
+    def test_asgi(self):
+        handler = ASGIStaticFilesHandler(None, self.root, '/static/')
+        scope = {'type': 'http', 'method': 'GET', 'path': '/static/css/site.css',
+                 'headers': [(b'range', b'bytes=2-')]}
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(handler(scope, None, send))
+        self.assertEqual(sent[0]['status'], 206)
+        self.assertEqual(b''.join(message.get('body', b'') for message in sent[1:]),
+                         self.content[2:])
+        # the last message ends the response
+        self.assertEqual(sent[-1], {'type': 'http.response.body'})
+
+
+class PooledASGIHandlerTests(SimpleTestCase):
+    def test_requests_run_on_the_pool(self):
+        handler = PooledASGIHandler(threads=2)
+        scope = {'type': 'http', 'method': 'GET', 'path': reverse('core:profiling-stats'),
+                 'query_string': b'', 'headers': [(b'host', b'testserver')],
+                 'server': ('testserver', 80)}
+        sent = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            sent.append(message)
+
+        async def request():
+            return await asyncio.gather(*[handler(scope, receive, send) for n in range(4)])
+
+        asyncio.run(request())
+        starts = [message for message in sent if message['type'] == 'http.response.start']
+        # anonymous users are sent to the admin login
+        self.assertEqual([message['status'] for message in starts], [302] * 4)
+        self.assertEqual(handler.executor._max_workers, 2)
+
+
+class BenchmarkBaselineTests(SimpleTestCase):
+    def test_find_regressions(self):
+        baseline = {'home': {'p95': 10.0, 'queries': 4}}
+        self.assertEqual(find_regressions({'home': {'p95': 12.0, 'queries': 4},
+                                           'new': {'p95': 99.0, 'queries': 9}},
+                                          baseline, 0.25), [])
+        self.assertEqual(find_regressions({'home': {'p95': 13.0, 'queries': 5}}, baseline, 0.25),
+                         ['home: p95 13.00ms, baseline 10.00ms', 'home: 5 queries, baseline 4'])
+
+
+class CartServiceTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('shopper', password='secret')
+        cls.item = Item.objects.create(title='Hoodie', price=30, description='Warm hoodie',
+                                       category='outweare', label='D')
+
+    def test_add_remove_and_add_again(self):
+        self.assertEqual(cart.add_item(self.user, self.item.pk).status, cart.ADDED)
+        self.assertEqual(cart.add_item(self.user, self.item.pk).status, cart.UPDATED)
+        self.assertEqual(cart.remove_item(self.user, self.item.pk).status, cart.REMOVED)
+        # the detached line is reused, starting over at one
+        change = cart.add_item(self.user, self.item.pk)
+        self.assertEqual(change.status, cart.ADDED)
+        self.assertEqual(change.order.items.get().quantity, 1)
+        self.assertEqual((change.order.item_count, change.order.total), (1, 30.0))
+
+    def test_remove_single_item(self):
+        self.assertEqual(cart.remove_single_item(self.user, self.item.pk).status, cart.NO_ORDER)
+        cart.add_item(self.user, self.item.pk)
+        cart.add_item(self.user, self.item.pk)
+        self.assertEqual(cart.remove_single_item(self.user, self.item.pk).status, cart.UPDATED)
+        self.assertEqual(cart.remove_single_item(self.user, self.item.pk).status, cart.REMOVED)
+        self.assertEqual(cart.remove_single_item(self.user, self.item.pk).status,
+                         cart.NOT_IN_CART)
+
+    def test_prices_are_snapshot(self):
+        cart.add_item(self.user, self.item.pk)
+        placed = Order.objects.get(user=self.user, ordered=False)
+        placed.items.update(ordered=True)
+        placed.ordered, placed.ordered_date = True, timezone.now()
+        placed.save()
+        cart.add_item(self.user, self.item.pk)
+        self.item.price = 40
+        self.item.save()
+        # the open cart follows the catalog, the placed order keeps its price
+        self.assertEqual(Order.objects.get(user=self.user, ordered=False).total, 40.0)
+        self.assertEqual(placed.get_totals()['total'], 30.0)
+        self.assertEqual(placed.items.get().price, 30.0)
+
+    def test_price_change_reaches_every_cart(self):
+        users = [get_user_model().objects.create_user(f'shopper{n}') for n in range(3)]
+        for user in users:
+            cart.add_item(user, self.item.pk)
+        self.item.price = 35
+        with self.assertNumQueries(6):
+            # the slug check and the save, the search index, then one UPDATE
+            # for the open lines and one for their carts whatever their number
+            self.item.save()
+        self.assertEqual(set(Order.objects.values_list('total', flat=True)), {35.0})
+
+    def test_placed_line_not_reused(self):
+        cart.add_item(self.user, self.item.pk)
+        cart.add_item(self.user, self.item.pk)
+        # placed by ticking the box in the admin: the line is still open
+        placed = Order.objects.get(user=self.user, ordered=False)
+        placed.ordered = True
+        placed.save()
+        self.assertEqual(cart.add_item(self.user, self.item.pk).status, cart.ADDED)
+        line = placed.items.get()
+        self.assertEqual((line.quantity, line.ordered), (2, True))
+        self.assertEqual(placed.get_totals()['total'], 60.0)
+
+
+class CookieCartTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('shopper', password='secret')
+        cls.items = [
+            Item.objects.create(title=f'Cap {n}', price=10, discount_price=8 if n else None,
+                                description='Cap', category='outweare', label='S')
+            for n in range(2)
+        ]
+
+    def test_anonymous_cart_skips_the_database_writes(self):
+        with CaptureQueriesContext(connection) as context:
+            for item in self.items + self.items[1:]:
+                self.client.get(reverse('core:add-to-cart', args=[item.slug]))
+        self.assertTrue(all(query['sql'].startswith('SELECT')
+                            for query in context.captured_queries))
+        self.assertFalse(OrderItem.objects.exists())
+        response = self.client.get(reverse('core:order-summery'))
+        self.assertEqual((response.context['object'].item_count,
+                          response.context['object'].total), (2, 26.0))
+
+    def test_cart_is_merged_at_checkout(self):
+        cart.add_item(self.user, self.items[1].pk)
+        for item in self.items:
+            self.client.get(reverse('core:add-to-cart', args=[item.slug]))
+        self.client.force_login(self.user)
+        self.client.get(reverse('core:checkout'))
+        order = Order.objects.get(user=self.user, ordered=False)
+        self.assertEqual(sorted(order.items.values_list('item_id', 'quantity')),
+                         [(self.items[0].pk, 1), (self.items[1].pk, 2)])
+        self.assertEqual((order.item_count, order.total), (2, 26.0))
+        # and dropped from the cookie
+        self.assertEqual(self.client.cookies['cart'].value, '')
+
+    def test_api(self):
+        url = reverse('core:api-remove-single-item', args=[self.items[1].slug])
+        self.assertEqual(self.client.get(url).status_code, 405)
+        self.client.post(reverse('core:api-add-to-cart', args=[self.items[1].slug]))
+        self.client.post(reverse('core:api-add-to-cart', args=[self.items[1].slug]))
+        self.assertEqual(self.client.post(url).json(), {
+            'status': cart.UPDATED,
+            'line': {'slug': self.items[1].slug, 'quantity': 1, 'final_price': 8.0,
+                     'amount_saved': 2.0},
+            'total': 8.0, 'item_count': 1,
+        })
+
+    def test_tampered_cookie_is_ignored(self):
+        self.client.cookies['cart'] = '{"%d":99}' % self.items[0].pk
+        response = self.client.get(reverse('core:order-summery'))
+        self.assertRedirects(response, '/')
+
+
+class OrderArchiveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('shopper', password='secret')
+        cls.item = Item.objects.create(title='Scarf', price=12, discount_price=9,
+                                       description='Scarf', category='outweare', label='P')
+        now = timezone.now()
+        cls.orders = []
+        for days in (200, 150, 10):
+            cart.add_item(cls.user, cls.item.pk)
+            order = Order.objects.get(user=cls.user, ordered=False)
+            OrderItem.objects.filter(order=order).update(ordered=True)
+            order.ordered, order.ordered_date = True, now - timedelta(days=days)
+            order.save()
+            cls.orders.append(order)
+        cart.add_item(cls.user, cls.item.pk)
+
+    def test_archive_in_batches(self):
+        with self.assertNumQueries(9):
+            # the savepoint, reading the batch, two INSERTs and three
+            # DELETEs: none per line
+            self.assertEqual(archive_orders(90, batch_size=1, max_batches=1), (1, 1))
+        # the next run carries on with what is left
+        self.assertEqual(archive_orders(90, batch_size=1), (1, 1))
+        self.assertEqual(archive_orders(90), (0, 0))
+        self.assertEqual(sorted(ArchivedOrder.objects.values_list('pk', flat=True)),
+                         [order.pk for order in self.orders[:2]])
+        self.assertEqual(list(Order.objects.order_by('pk').values_list('ordered', flat=True)),
+                         [True, False])
+        self.assertEqual(OrderItem.objects.count(), 2)
+
+        self.client.force_login(self.user)
+        with self.assertNumQueries(6):
+            # the session and user, then live and archived orders with their lines
+            orders = self.client.get(reverse('core:api-order-history')).json()['orders']
+        self.assertEqual([(order['id'], order['archived']) for order in orders],
+                         [(self.orders[2].pk, False), (self.orders[1].pk, True),
+                          (self.orders[0].pk, True)])
+        self.assertEqual(orders[1]['lines'], [
+            {'title': 'Scarf', 'slug': self.item.slug, 'quantity': 1, 'final_price': 9.0}])
+
+
+class SalesReportTests(TestCase):
+    def test_report(self):
+        user = get_user_model().objects.create_user('shopper', password='secret')
+        items = [Item.objects.create(title='Tee', price=10, discount_price=discount,
+                                     description='Tee', category=category, label='P')
+                 for discount, category in [(None, 'shirt'), (8, 'shirt'), (0, 'outweare')]]
+        for days, quantities in [(3, [1, 2, 0]), (1, [0, 3, 4])]:
+            for item, quantity in zip(items, quantities):
+                for _ in range(quantity):
+                    cart.add_item(user, item.pk)
+            order = Order.objects.get(user=user, ordered=False)
+            OrderItem.objects.filter(order=order).update(ordered=True)
+            order.ordered = True
+            order.ordered_date = timezone.now() - timedelta(days=days)
+            order.save()
+        # an open cart is not a sale
+        cart.add_item(user, items[0].pk)
+        archive_orders(2)
+
+        report = SalesReport(chunk_size=2).run()
+        self.assertEqual(report.lines, 4)
+        self.assertEqual(report.rows('category'), (['category'], [
+            ['shirt', 50.0, 6, 10.0, 3], ['outweare', 40.0, 4, 0.0, 1]]))
+        self.assertEqual(report.rows('item')[1][1], [items[1].pk, items[1].slug, 40.0, 5, 10.0, 2])
+        days = report.rows('day')[1]
+        self.assertEqual([row[1:] for row in days], [[26.0, 3, 4.0, 2], [64.0, 7, 6.0, 2]])
+
+        stdout = io.StringIO()
+        call_command('analytics', '--by', 'category', '--format', 'json', stdout=stdout)
+        self.assertIn('"revenue": 50.0', stdout.getvalue())
+
+
+class RecommendationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('shopper', password='secret')
+        cls.items = [Item.objects.create(title=f'Mug {n}', price=6, description='Mug',
+                                         category='outweare', label='S') for n in range(4)]
+
+    def place_order(self, items):
+        for item in items:
+            cart.add_item(self.user, item.pk)
+        order = Order.objects.get(user=self.user, ordered=False)
+        OrderItem.objects.filter(order=order).update(ordered=True)
+        order.ordered = True
+        order.save()
+        return order
+
+    def test_refresh(self):
+        mugs = self.items
+        order = self.place_order(mugs[:3])
+        self.place_order(mugs[:2])
+        self.assertEqual(recommendations.refresh(chunk_size=1), (2, 8))
+        self.assertEqual(recommendations.refresh(), (0, 0))
+        # saving a counted order again, as the admin or its totals do,
+        # doesn't count it twice
+        Order.objects.get(pk=order.pk).save()
+        Order.objects.get(pk=order.pk).update_totals()
+        self.assertEqual(recommendations.refresh(), (0, 0))
+        self.place_order([mugs[0], mugs[3]])
+        self.assertEqual(recommendations.refresh(), (1, 2))
+        self.assertEqual(list(ItemPair.objects.filter(item=mugs[0]).order_by(
+            '-count', 'other').values_list('other', 'count')),
+            [(mugs[1].pk, 2), (mugs[2].pk, 1), (mugs[3].pk, 1)])
+
+        url = reverse('core:product', args=[mugs[0].slug])
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.content.decode().count('href="/product/mug-'), 6)
+
+        recommendations.reset()
+        self.assertEqual(recommendations.refresh(), (3, 8))
+
+
+class PurgeCartsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.users = [User.objects.create_user(f'shopper{n}', password='secret')
+                     for n in range(3)]
+        cls.items = [Item.objects.create(title=f'Sock {n}', price=3, description='Sock',
+                                         category='shirt', label='S') for n in range(2)]
+
+    def test_purge(self):
+        for user in self.users:
+            for item in self.items:
+                cart.add_item(user, item.pk)
+        # a detached line, and a cart left alone for two months
+        cart.remove_item(self.users[0], self.items[0].pk)
+        Order.objects.filter(user=self.users[1]).update(
+            updated=timezone.now() - timedelta(days=60))
+
+        self.assertEqual(purge_carts(30, batch_size=1), (1, 3))
+        self.assertEqual(sorted(Order.objects.values_list('user', flat=True)),
+                         [self.users[0].pk, self.users[2].pk])
+        self.assertEqual(OrderItem.objects.count(), 3)
+        self.assertEqual(purge_carts(30), (0, 0))
+        # the removed item can still be added again
+        self.assertEqual(cart.add_item(self.users[0], self.items[0].pk).status, cart.ADDED)
+
+
+class AdminTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        cls.users = [User.objects.create_user(f'shopper{n}', password='secret')
+                     for n in range(4)]
+        cls.items = [Item.objects.create(title=f'Cap {n}', price=20, description='Cap',
+                                         category='outweare', label='P') for n in range(2)]
+        for user in cls.users:
+            for item in cls.items:
+                cart.add_item(user, item.pk)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def changelist_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(context.captured_queries)
+
+    def test_changelists(self):
+        for model in ('order', 'orderitem', 'item', 'archivedorder'):
+            url = reverse(f'admin:core_{model}_changelist')
+            queries = self.changelist_queries(url)
+            cart.add_item(get_user_model().objects.create_user(f'late-{model}'),
+                          self.items[0].pk)
+            # no query per row
+            self.assertEqual(self.changelist_queries(url), queries, model)
+        response = self.client.get(reverse('admin:core_order_changelist'), {'q': 'shopper1'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+    def test_estimated_count(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        paginator = EstimatedCountPaginator(Order.objects.order_by('pk'), 10)
+        paginator.exact_count_below = 1
+        with self.assertNumQueries(2):
+            self.assertEqual(paginator.count, 4)
+        # the statistics are stale now, and a filter needs a real count
+        Order.objects.filter(user=self.users[0]).delete()
+        paginator = EstimatedCountPaginator(Order.objects.filter(ordered=False).order_by('pk'), 10)
+        paginator.exact_count_below = 1
+        self.assertEqual(paginator.count, 3)
+
+    def test_actions(self):
+        url = reverse('admin:core_item_changelist')
+        self.client.post(url, {'action': 'put_on_sale', '_selected_action': [self.items[0].pk]})
+        self.assertEqual(Item.objects.get(pk=self.items[0].pk).discount_price, 18)
+        self.assertEqual(Order.objects.get(user=self.users[0]).total, 38)
+
+        orders = Order.objects.filter(user__in=self.users[:2])
+        self.client.post(reverse('admin:core_order_changelist'), {
+            'action': 'mark_ordered', '_selected_action': [order.pk for order in orders]})
+        self.assertEqual(list(Order.objects.order_by('pk').values_list('ordered', flat=True)),
+                         [True, True, False, False])
+        self.assertEqual(OrderItem.objects.filter(ordered=True).count(), 4)
+        self.client.post(url, {'action': 'end_sale', '_selected_action': [self.items[0].pk]})
+        # placed orders keep the price they were sold at
+        self.assertEqual(Order.objects.get(user=self.users[0]).total, 38)
+        self.assertEqual(Order.objects.get(user=self.users[2]).total, 40)
+
+
+class ProductPageCacheTests(TransactionTestCase):
+    def test_version_bumped_on_commit(self):
+        item = Item.objects.create(title='Beanie', price=10, description='Beanie',
+                                   category='outweare', label='P')
+        url = reverse('core:product', args=[item.slug])
+        self.client.get(url)
+        version = get_product_version(item.slug)
+        with transaction.atomic():
+            item.price = 12.5
+            item.save()
+            # a page rendered now by another connection would read the old row
+            self.assertEqual(get_product_version(item.slug), version)
+        self.assertNotEqual(get_product_version(item.slug), version)
+        self.assertContains(self.client.get(url), '$12.5')
+
+    def test_repriced_neighbour(self):
+        user = get_user_model().objects.create_user('shopper', password='secret')
+        mug, cup = [Item.objects.create(title=title, price=6, description=title,
+                                        category='outweare', label='S')
+                    for title in ('Mug', 'Cup')]
+        cart.add_item(user, mug.pk)
+        cart.add_item(user, cup.pk)
+        Order.objects.filter(user=user).place()
+        recommendations.refresh()
+        url = reverse('core:product', args=[mug.slug])
+        self.assertContains(self.client.get(url), '<strong>6.0$</strong>')
+        cup.price = 7.5
+        cup.save()
+        # the neighbour's card follows its price at once
+        self.assertContains(self.client.get(url), '<strong>7.5$</strong>')
+
+    def test_missing_item_leaves_no_keys(self):
+        cache.clear()
+        for n in range(3):
+            url = reverse('core:product', args=[f'no-such-item-{n}'])
+            self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(list(cache._cache), [])
+
+
+class CartCountCacheTests(TransactionTestCase):
+    def test_count_follows_commits(self):
+        user = get_user_model().objects.create_user('shopper', password='secret')
+        item = Item.objects.create(title='Glove', price=4, description='Glove',
+                                   category='outweare', label='P')
+        cache.delete(cart_count_key(user.pk))
+        with self.assertRaises(ValueError), transaction.atomic():
+            cart.add_item(user, item.pk)
+            raise ValueError
+        self.assertIsNone(cache.get(cart_count_key(user.pk)))
+        cart.add_item(user, item.pk)
+        self.assertEqual(cache.get(cart_count_key(user.pk)), 1)
+
+
+class CartConcurrencyTests(TransactionTestCase):
+    threads = 8
+    clicks = 5
+
+    def test_concurrent_adds_to_one_cart(self):
+        user = get_user_model().objects.create_user('shopper', password='secret')
+        items = [Item.objects.create(title=f'Tee {n}', price=10, description='Tee',
+                                     category='shirt', label='P') for n in range(2)]
+        start = threading.Barrier(self.threads)
+        errors = []
+
+        def click():
+            try:
+                start.wait()
+                for n in range(self.clicks):
+                    self.retry_when_locked(lambda: cart.add_item(user, items[n % 2].pk))
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connections.close_all()
+
+        workers = [threading.Thread(target=click) for n in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        order = Order.objects.get(user=user, ordered=False)
+        quantities = sorted(order.items.values_list('quantity', flat=True))
+        self.assertEqual(sum(quantities), self.threads * self.clicks)
+        self.assertEqual(len(quantities), 2)
+        self.assertEqual(order.item_count, 2)
+        self.assertEqual(order.total, self.threads * self.clicks * 10)
+
+    def retry_when_locked(self, change):
+        # SQLite has no row locks: a writer that finds the database busy
+        # fails its whole transaction instead of waiting, so try again
+        for attempt in range(1000):
+            try:
+                return change()
+            except OperationalError:
+                if connection.vendor != 'sqlite':
+                    raise
+                time.sleep(random.uniform(0.001, 0.02))
+        raise AssertionError('the cart stayed locked')
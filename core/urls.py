@@ -7,14 +7,22 @@ urlpatterns = [
     path('', views.HomeView.as_view(), name='home'),
     path('category/<str:category>/',
          views.ItemCategory.as_view(), name='item_category'),
+    path('catalog/', views.ItemFacets.as_view(), name='item_facets'),
     path('product/<slug>/', views.ItemDetailView.as_view(), name='product'),
     path('add-to-cart/<slug>/', views.add_to_cart, name='add-to-cart'),
     path('remove-from-cart/<slug>/',
          views.remove_from_cart, name='remove-from-cart'),
     path('remove-single-item/<slug>/',
          views.remove_single_item_from_cart, name='remove-single-item'),
+    path('api/add-to-cart/<slug>/', views.api_add_to_cart, name='api-add-to-cart'),
+    path('api/remove-from-cart/<slug>/',
+         views.api_remove_from_cart, name='api-remove-from-cart'),
+    path('api/remove-single-item/<slug>/',
+         views.api_remove_single_item_from_cart, name='api-remove-single-item'),
+    path('api/orders/', views.api_order_history, name='api-order-history'),
     path('order-summery/', views.OrderSummeryView.as_view(), name='order-summery'),
     path('checkout/', views.CheckoutView.as_view(), name='checkout'),
     path('search/', views.ItemSearch.as_view(), name='item_search'),
     path('payment/<payment_option>/', views.PaymentView.as_view(), name='payment'),
+    path('profiling-stats/', views.profiling_stats, name='profiling-stats'),
 ]
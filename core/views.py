@@ -1,16 +1,30 @@
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse
+from django.views.decorators.http import require_POST
 from django.shortcuts import render, get_object_or_404, redirect
 from django.views.generic import ListView, DetailView, View
-from .models import Item, OrderItem, Order, BillingAddress
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from . import cart
+from .archive import order_history
+from .caching import PRODUCT_PAGE_TIMEOUT, get_product_version, product_page_key
+from .facets import FACETS, filter_items, get_facet_index
+from .models import Item, Order, OrderItem, BillingAddress
 from .forms import CheckoutForm
-from django.utils import timezone
+from .pagination import KeysetPaginationMixin
+from .profiling import view_stats
+from .recommendations import get_recommendations_html
+from djecommerce.db.pool import pool_stats
+from .search import get_search_backend
 from django.core.exceptions import ObjectDoesNotExist
-from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 # Create your views here.
 
 
-class HomeView(ListView):
+class HomeView(KeysetPaginationMixin, ListView):
     model = Item
     paginate_by = 12
     template_name = "pages/home-page.html"
@@ -19,11 +33,29 @@ class HomeView(ListView):
 class ItemDetailView(DetailView):
     model = Item
     template_name = "pages/product-page.html"
+    detail_template_name = "pages/product-detail.html"
+
+    # The product markup is the same for everyone, so it is cached per item
+    # version and only the page around it (navbar, messages) is rendered
+    # for the current user.
+    def get(self, request, *args, **kwargs):
+        slug = self.kwargs['slug']
+        key = product_page_key(slug, get_product_version(slug))
+        product_html = cache.get(key)
+        if product_html is None:
+            self.object = self.get_object()
+            product_html = render_to_string(
+                self.detail_template_name, {'object': self.object})
+            cache.set(key, product_html, PRODUCT_PAGE_TIMEOUT)
+        return render(request, self.template_name, {
+            'product_html': mark_safe(product_html),
+            'recommendations_html': mark_safe(get_recommendations_html(slug)),
+        })
 
 # Item view by Category
 
 
-class ItemCategory(ListView):
+class ItemCategory(KeysetPaginationMixin, ListView):
     model = Item
     template_name = "pages/home-page.html"
     paginate_by = 12
@@ -38,12 +70,55 @@ class ItemCategory(ListView):
         return context
 
 
-class OrderSummeryView(LoginRequiredMixin, View):
+# Items filtered by any mix of category, label, price range and sale, with
+# the count of every choice taken from the facet index
+
+
+class ItemFacets(KeysetPaginationMixin, ListView):
+    model = Item
+    template_name = "pages/catalog-page.html"
+    paginate_by = 12
+
+    def get_selection(self):
+        selected = {}
+        for facet, choices in FACETS.items():
+            values = set(self.request.GET.getlist(facet)) & {value for value, _ in choices}
+            if values:
+                selected[facet] = values
+        return selected
+
+    def get_queryset(self):
+        self.selected = self.get_selection()
+        self.facet_index = get_facet_index()
+        return filter_items(Item.objects.all(), self.selected)
+
+    def paginate_queryset(self, queryset, page_size):
+        # the index picks the page's ids; the rows read for them are checked
+        # against the filter, in case the index is behind the table
+        page = self.facet_index.page(self.facet_index.match(self.selected), page_size,
+                                     self.request.GET.get(self.cursor_kwarg))
+        page.object_list = list(queryset.filter(pk__in=page.object_list).order_by('pk'))
+        return self.paginated(None, page)
+
+    def get_context_data(self, **kwargs):
+        context = super(ItemFacets, self).get_context_data(**kwargs)
+        context['facets'] = self.facet_index.counts(self.selected)
+        return context
+
+
+class OrderSummeryView(View):
     def get(self, *args, **kwargs):
         try:
-            order = Order.objects.get(user=self.request.user, ordered=False)
+            if self.request.user.is_authenticated:
+                order = Order.objects.active_cart_for(self.request.user)
+                order_items = order.items.all()
+            elif self.request.cookie_cart:
+                order, order_items = self.request.cookie_cart.snapshot()
+            else:
+                raise ObjectDoesNotExist
             context = {
-                'object': order
+                'object': order,
+                'order_items': order_items,
             }
             return render(self.request, 'pages/order_summery.html', context)
         except ObjectDoesNotExist:
@@ -51,11 +126,19 @@ class OrderSummeryView(LoginRequiredMixin, View):
             return redirect("/")
 
 
-class CheckoutView(View):
+class CheckoutView(LoginRequiredMixin, View):
+    def dispatch(self, request, *args, **kwargs):
+        # a cart kept in the cookie is persisted once its owner checks out
+        if request.user.is_authenticated and request.cookie_cart:
+            cart.merge_items(request.user, request.cookie_cart.quantities)
+            request.cookie_cart.clear()
+        return super().dispatch(request, *args, **kwargs)
+
     def get(self, *args, **kwargs):
         form = CheckoutForm()
         context = {
-            'form': form
+            'form': form,
+            'order': Order.objects.filter(user=self.request.user, ordered=False).first(),
         }
         return render(self.request, 'pages/checkout-page.html', context)
 
@@ -81,6 +164,11 @@ class CheckoutView(View):
                     zip_code=zip_code
                 )
                 billing_address.save()
+                # the order is placed at the prices of the moment, which
+                # queryset updates to Item may have skipped
+                order.items.snapshot_prices()
+                totals = order.get_totals()
+                order.total, order.item_count = totals['total'], totals['item_count']
                 order.billing_address = billing_address
                 order.save()
                 # TODO: redirect to the selected payment options
@@ -98,102 +186,122 @@ class PaymentView(View):
         return render(self.request, 'pages/payment.html')
 
 
-@login_required
+def get_cart(request):
+    """
+    Where the request's cart lives: the database for a logged in user, the
+    signed cookie for an anonymous visitor.
+    """
+    if request.user.is_authenticated:
+        return cart.UserCart(request.user)
+    return request.cookie_cart
+
+
 def add_to_cart(request, slug):
-    item = get_object_or_404(Item, slug=slug)
-    order_item, created = OrderItem.objects.get_or_create(
-        item=item,
-        user=request.user,
-        ordered=False
-    )
-    order_qs = Order.objects.filter(user=request.user, ordered=False)
-
-    if order_qs.exists():
-        order = order_qs[0]
-        # check if the order item is in the order
-        if order.items.filter(item__slug=item.slug).exists():
-            order_item.quantity += 1
-            order_item.save()
-            messages.info(request, "Updated This Item Quantity")
-            return redirect("core:order-summery")
-        else:
-            order.items.add(order_item)
-            messages.info(request, "This Item has Added to Your Cart")
-            return redirect("core:order-summery")
+    item_id = get_object_or_404(Item.objects.values_list('pk', flat=True), slug=slug)
+    change = get_cart(request).add_item(item_id)
+    if change.status == cart.UPDATED:
+        messages.info(request, "Updated This Item Quantity")
+    elif change.status == cart.NOT_IN_CART:
+        messages.warning(request, "Your Cart is full, please log in to add more items")
     else:
-        ordered_date = timezone.now()
-        order = Order.objects.create(
-            user=request.user, ordered_date=ordered_date)
-        order.items.add(order_item)
         messages.info(request, "This Item has Added to Your Cart")
-        return redirect("core:order-summery")
+    return redirect("core:order-summery")
 
 
-@login_required
 def remove_from_cart(request, slug):
-    item = get_object_or_404(Item, slug=slug)
-    order_qs = Order.objects.filter(user=request.user, ordered=False)
-    if order_qs.exists():
-        order = order_qs[0]
-        # check if the order item is in the order
-        if order.items.filter(item__slug=item.slug).exists():
-            order_item = OrderItem.objects.filter(
-                item=item, user=request.user, ordered=False)[0]
-            order.items.remove(order_item)
-            messages.warning(request, "This Item has removed from Your Cart")
-            return redirect("core:order-summery")
-        else:
-            messages.info(request, "This Item was not in Your Cart")
-            return redirect("core:product", slug=slug)
+    item_id = get_object_or_404(Item.objects.values_list('pk', flat=True), slug=slug)
+    change = get_cart(request).remove_item(item_id)
+    if change.status == cart.REMOVED:
+        messages.warning(request, "This Item has removed from Your Cart")
+        return redirect("core:order-summery")
+    elif change.status == cart.NOT_IN_CART:
+        messages.info(request, "This Item was not in Your Cart")
     else:
         messages.info(request, "You do no have an active order")
-        return redirect("core:product", slug=slug)
+    return redirect("core:product", slug=slug)
 
 # remove single item quantity
 
 
-@login_required
 def remove_single_item_from_cart(request, slug):
-    item = get_object_or_404(Item, slug=slug)
-    order_qs = Order.objects.filter(user=request.user, ordered=False)
-    if order_qs.exists():
-        order = order_qs[0]
-        # check if the order item is in the order
-        if order.items.filter(item__slug=item.slug).exists():
-            order_item = OrderItem.objects.filter(
-                item=item, user=request.user, ordered=False)[0]
-
-            if order_item.quantity > 1:
-                order_item.quantity -= 1
-                order_item.save()
-            else:
-                order.items.remove(order_item)
-                messages.warning(
-                    request, "This Item has removed from Your Cart")
-                return redirect("core:order-summery")
-
-            messages.warning(request, "Updated Item Quantity")
-            return redirect("core:order-summery")
-        else:
-            messages.info(request, "This Item was not in Your Cart")
-            return redirect("core:product", slug=slug)
+    item_id = get_object_or_404(Item.objects.values_list('pk', flat=True), slug=slug)
+    change = get_cart(request).remove_single_item(item_id)
+    if change.status == cart.REMOVED:
+        messages.warning(request, "This Item has removed from Your Cart")
+        return redirect("core:order-summery")
+    elif change.status == cart.UPDATED:
+        messages.warning(request, "Updated Item Quantity")
+        return redirect("core:order-summery")
+    elif change.status == cart.NOT_IN_CART:
+        messages.info(request, "This Item was not in Your Cart")
     else:
         messages.info(request, "You do no have an active order")
-        return redirect("core:product", slug=slug)
+    return redirect("core:product", slug=slug)
+
+
+# The same cart changes for the order summary page's script, answered with
+# only what changed instead of a redirect and a full page
+
+
+def cart_delta(request, slug, action):
+    item_id = get_object_or_404(Item.objects.values_list('pk', flat=True), slug=slug)
+    change = getattr(get_cart(request), action)(item_id)
+    if request.user.is_authenticated:
+        order = change.order
+        line = order and OrderItem.objects.filter(
+            order=order, item_id=item_id).with_line_totals().first()
+    else:
+        order, lines = request.cookie_cart.snapshot()
+        line = next((line for line in lines if line.item_id == item_id), None)
+    return JsonResponse({
+        'status': change.status,
+        'line': line and {
+            'slug': slug,
+            'quantity': line.quantity,
+            'final_price': line.line_final_price,
+            'amount_saved': line.line_amount_saved,
+        },
+        'total': order.total if order else 0,
+        'item_count': order.item_count if order else 0,
+    })
+
+
+@require_POST
+def api_add_to_cart(request, slug):
+    return cart_delta(request, slug, 'add_item')
+
+
+@require_POST
+def api_remove_from_cart(request, slug):
+    return cart_delta(request, slug, 'remove_item')
+
+
+@require_POST
+def api_remove_single_item_from_cart(request, slug):
+    return cart_delta(request, slug, 'remove_single_item')
+
+
+@login_required
+def api_order_history(request):
+    # completed orders whether they are still live or already archived
+    return JsonResponse({'orders': order_history(request.user)})
 
 
 # Item search
 
 
-class ItemSearch(ListView):
+class ItemSearch(KeysetPaginationMixin, ListView):
     model = Item
     template_name = "pages/home-page.html"
     paginate_by = 12
 
+    def get_keyset_ordering(self):
+        return get_search_backend().ordering
+
     def get_queryset(self):
         query = self.request.GET.get('query')
         if query:
-            object_list = self.model.objects.filter(title__icontains=query)
+            object_list = get_search_backend().search(self.model.objects.all(), query)
         else:
             object_list = self.model.objects.none()
         return object_list
@@ -202,3 +310,12 @@ class ItemSearch(ListView):
         context = super(ItemSearch, self).get_context_data(**kwargs)
         context['search_query'] = self.request.GET.get('query')
         return context
+
+
+@staff_member_required
+def profiling_stats(request):
+    """
+    Request timings per URL name since this process started, in ms, and
+    the database connection pools of this process.
+    """
+    return JsonResponse({'views': view_stats.snapshot(), 'database_pools': pool_stats()})
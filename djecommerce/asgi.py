@@ -0,0 +1,16 @@
+import os
+
+import django
+from django.conf import settings
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'djecommerce.settings')
+
+django.setup(set_prefix=False)
+
+from djecommerce.asgi_handler import PooledASGIHandler  # noqa: E402
+
+application = PooledASGIHandler(settings.ASGI_THREADS)
+
+if settings.SERVE_STATIC_FILES:
+    from djecommerce.static_handler import ASGIStaticFilesHandler
+    application = ASGIStaticFilesHandler(application, settings.STATIC_ROOT, settings.STATIC_URL)
@@ -0,0 +1,33 @@
+"""
+Django 3.0 runs the sync request handling of every ASGI request through
+asgiref's sync_to_async, which, now that it is thread sensitive by
+default, puts all requests of a process on a single thread. The handler
+here gives them a bounded pool of threads instead: the event loop keeps
+reading requests from and writing responses to any number of slow
+connections, while at most `threads` requests run views and ORM queries.
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.base import BaseHandler
+from django.db import close_old_connections
+
+
+class PooledASGIHandler(ASGIHandler):
+    def __init__(self, threads):
+        super().__init__()
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='asgi-request')
+
+    async def get_response(self, request):
+        # ASGIHandler awaits a coroutine get_response() instead of wrapping it
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, functools.partial(self.get_response_in_thread, request))
+
+    def get_response_in_thread(self, request):
+        try:
+            return BaseHandler.get_response(self, request)
+        finally:
+            # what request_finished does for a WSGI request, on the thread
+            # that used the connections
+            close_old_connections()
@@ -4,6 +4,8 @@ from .settings import *
 DEBUG = True
 ALLOWED_HOSTS += ['*']
 WSGI_APPLICATION = 'market.wsgi.application'
+# a public site: timings stay in the staff-only profiling_stats view
+SERVER_TIMING = False
 
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -14,17 +16,53 @@ AUTH_PASSWORD_VALIDATORS = [
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        # connections are kept open in a pool, see djecommerce/db
+        'ENGINE': 'djecommerce.db.pooled_postgresql',
         'NAME': os.getenv('APP_DB_NAME'),
         'USER': '{}@{}'.format(os.getenv('POSTGRES_ADMIN_USER'), os.getenv('POSTGRES_SERVER_NAME')),
         'PASSWORD': os.getenv('POSTGRES_ADMIN_PASSWORD'),
         'HOST': os.getenv('POSTGRES_HOST'),
         'PORT': '5432',
-        'OPTIONS': {'sslmode': 'require'},
+        'OPTIONS': {
+            'sslmode': 'require',
+            'POOL': {
+                # per worker process
+                'max_size': int(os.getenv('DB_POOL_SIZE', 10)),
+                'timeout': float(os.getenv('DB_POOL_TIMEOUT', 30)),
+            },
+        },
     }
 }
 
-STATICFILES_STORAGE = 'storages.backends.azure_storage.AzureStorage'
+# shared by all the worker processes and instances: Azure Cache for Redis,
+# e.g. REDIS_URL=rediss://:<access key>@<name>.redis.cache.windows.net:6380/0
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+            'OPTIONS': {
+                'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            },
+        }
+    }
+else:
+    # a single instance only. Every set() lists the cache directory, and
+    # past MAX_ENTRIES a third of the entries are dropped at random, so it
+    # must hold a cart count per active user and a page and card per item
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv('CACHE_LOCATION', '/tmp/djecommerce-cache'),
+            'OPTIONS': {
+                'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 50000)),
+            },
+        }
+    }
+
+STATICFILES_STORAGE = 'core.azure_storage.AzureManifestStaticStorage'
+# pages only link the hashed names, so their content never changes
+AZURE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
 AZURE_ACCOUNT_NAME = os.getenv('AZ_STORAGE_ACCOUNT_NAME')
 AZURE_CONTAINER = os.getenv('AZ_STORAGE_CONTAINER')
 AZURE_ACCOUNT_KEY = os.getenv('AZ_STORAGE_KEY')
@@ -0,0 +1,159 @@
+"""
+A thread-safe pool of database connections, independent of the driver:
+it is given functions to open, check, reset and close a connection, so it
+can be exercised with stand-in connections.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Hands out at most max_size connections. A connection that has been
+    idle for longer than check_after seconds is health checked before it
+    is reused, and one older than max_lifetime is replaced.
+    """
+
+    def __init__(self, connect, check=None, reset=None, close=None, max_size=10,
+                 timeout=30, check_after=5, max_lifetime=3600):
+        self.connect = connect
+        self.check = check or (lambda connection: True)
+        self.reset = reset or (lambda connection: None)
+        self.close = close or (lambda connection: connection.close())
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_after = check_after
+        self.max_lifetime = max_lifetime
+        self.lock = threading.Condition()
+        self.stats = dict.fromkeys([
+            'connects', 'reconnects', 'checkouts', 'waits', 'timeouts',
+            'failed_checks', 'discarded'], 0)
+        self.stats['wait_time'] = 0.0
+        self.start()
+
+    def start(self):
+        self.pid = os.getpid()
+        # (connection, opened at, returned at), most recently returned last
+        self.idle = deque()
+        self.opened = {}
+        self.in_use = 0
+
+    def get(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                # forked: the parent's sockets must not be shared
+                self.start()
+            waited = None
+            while not self.idle and self.in_use >= self.max_size:
+                if waited is None:
+                    waited = time.monotonic()
+                    self.stats['waits'] += 1
+                remaining = self.timeout - (time.monotonic() - waited)
+                if remaining <= 0 or not self.lock.wait(remaining):
+                    self.stats['timeouts'] += 1
+                    self.stats['wait_time'] += time.monotonic() - waited
+                    raise PoolTimeout(
+                        f'no connection free after {self.timeout}s ({self.max_size} in use)')
+            if waited is not None:
+                self.stats['wait_time'] += time.monotonic() - waited
+            entry = self.idle.pop() if self.idle else None
+            self.in_use += 1
+            self.stats['checkouts'] += 1
+        try:
+            return self.reuse(entry) if entry else self.open()
+        except Exception:
+            with self.lock:
+                self.in_use -= 1
+                self.lock.notify()
+            raise
+
+    def reuse(self, entry):
+        connection, opened, returned = entry
+        now = time.monotonic()
+        healthy = now - opened < self.max_lifetime
+        if healthy and now - returned > self.check_after:
+            healthy = self.safely(self.check, connection)
+            if not healthy:
+                self.count('failed_checks')
+        if healthy:
+            return connection
+        self.discard(connection)
+        self.count('reconnects')
+        return self.open()
+
+    def open(self):
+        connection = self.connect()
+        with self.lock:
+            self.stats['connects'] += 1
+            self.opened[id(connection)] = time.monotonic()
+        return connection
+
+    def put(self, connection, discard=False):
+        """Returns a connection from get(); discard closes it instead."""
+        if not discard and not self.safely(self.reset, connection):
+            discard = True
+        with self.lock:
+            self.in_use -= 1
+            discard = discard or self.pid != os.getpid()
+            if not discard:
+                opened = self.opened.get(id(connection), time.monotonic())
+                self.idle.append((connection, opened, time.monotonic()))
+            self.lock.notify()
+        if discard:
+            self.discard(connection)
+
+    def discard(self, connection):
+        with self.lock:
+            self.opened.pop(id(connection), None)
+            self.stats['discarded'] += 1
+        self.safely(self.close, connection)
+
+    def close_all(self):
+        with self.lock:
+            idle, self.idle = self.idle, deque()
+        for connection, opened, returned in idle:
+            self.discard(connection)
+
+    def count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def safely(self, function, connection):
+        try:
+            result = function(connection)
+        except Exception:
+            return False
+        return result is not False
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, size=self.in_use + len(self.idle), idle=len(self.idle),
+                        in_use=self.in_use, max_size=self.max_size)
+
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_pool(name, params, **kwargs):
+    """
+    The pool for the database `name` connects to with `params`; the test
+    runner switching the database gets a pool of its own.
+    """
+    key = (name, repr(sorted(params.items())))
+    with pools_lock:
+        if key not in pools:
+            pools[key] = ConnectionPool(**kwargs)
+        return pools[key]
+
+
+def pool_stats():
+    """Statistics of every pool in this process, by database."""
+    with pools_lock:
+        return {name: pool.get_stats() for (name, params), pool in pools.items()}
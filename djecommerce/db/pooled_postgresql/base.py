@@ -0,0 +1,65 @@
+"""
+PostgreSQL backend that keeps connections open in a per-process pool, so a
+request reuses one instead of paying for a new TLS handshake and login.
+
+    'ENGINE': 'djecommerce.db.pooled_postgresql',
+    'OPTIONS': {'POOL': {'max_size': 10, 'timeout': 30}},
+
+Django "closes" the connection at the end of every request (keep
+CONN_MAX_AGE at 0) and this returns it to the pool.
+"""
+from django.db.backends.postgresql import base
+from djecommerce.db.pool import get_pool
+
+Database = base.Database
+
+
+def check(connection):
+    if connection.closed:
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+    if not connection.autocommit:
+        connection.rollback()
+
+
+def reset(connection):
+    if connection.closed:
+        return False
+    # whatever a request left open is rolled back before the next one
+    if connection.get_transaction_status() != Database.extensions.TRANSACTION_STATUS_IDLE:
+        connection.rollback()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        options = self.settings_dict['OPTIONS']
+        self.pool_options = options.get('POOL', {})
+        self.settings_dict['OPTIONS'] = {
+            key: value for key, value in options.items() if key != 'POOL'}
+        try:
+            return super().get_connection_params()
+        finally:
+            self.settings_dict['OPTIONS'] = options
+
+    def get_new_connection(self, conn_params):
+        self.pool = get_pool(
+            '%s/%s' % (self.alias, conn_params.get('database')), conn_params,
+            connect=lambda: Database.connect(**conn_params),
+            check=check, reset=reset, **self.pool_options)
+        connection = self.pool.get()
+        # as in the parent, for a new and a reused connection alike
+        options = self.settings_dict['OPTIONS']
+        try:
+            self.isolation_level = options['isolation_level']
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+        return connection
+
+    def _close(self):
+        # a connection closed inside atomic() stays referenced by this
+        # wrapper, so it must not be handed to another thread
+        self.pool.put(self.connection, discard=self.in_atomic_block)
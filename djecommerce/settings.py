@@ -22,15 +22,17 @@ INSTALLED_APPS = [
     'django_countries',
 
 
-    'core',
+    'core.apps.CoreConfig',
 ]
 
 MIDDLEWARE = [
+    'core.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.CookieCartMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware'
 ]
@@ -51,6 +53,7 @@ TEMPLATES = [
             ],
             'libraries':{
                 'cart_template_tags': 'djecommerce.templatetags.cart_template_tags',
+                'catalog_template_tags': 'djecommerce.templatetags.catalog_template_tags',
 
             }
         },
@@ -66,6 +69,13 @@ USE_TZ = True
 STATIC_URL = '/static/'
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 STATIC_ROOT = os.path.join(BASE_DIR, 'assets')
+# serve STATIC_ROOT from the WSGI application, see djecommerce/static_handler.py
+SERVE_STATIC_FILES = False
+# requests running at once in an ASGI worker process, see djecommerce/asgi.py
+ASGI_THREADS = int(os.getenv('ASGI_THREADS', 10))
+# send the request's db/template/view timings back in a Server-Timing
+# header, see core/middleware.py; they are for developers' eyes only
+SERVER_TIMING = True
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
@@ -76,6 +86,12 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
 if ENVIRONMENT == 'production':
     DEBUG = False
     SECRET_KEY = os.getenv('SECRET_KEY')
@@ -87,6 +103,10 @@ if ENVIRONMENT == 'production':
     SECURE_REDIRECT_EXEMPT = []
     SECURE_SSL_REDIRECT = True
     SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
+    # hashed, minified and precompressed by collectstatic, see core/storage.py
+    STATICFILES_STORAGE = 'core.storage.CompressedManifestStaticFilesStorage'
+    SERVE_STATIC_FILES = True
+    SERVER_TIMING = False
 
 
 # auth
@@ -0,0 +1,256 @@
+"""
+Serves STATIC_ROOT from the WSGI application itself, without a separate
+web server.
+
+The files are indexed once at startup, so a request costs a dictionary
+lookup: no stat() calls and no trip through Django's URL resolver and
+middleware. Bodies go out through the server's wsgi.file_wrapper (sendfile
+under gunicorn) or are read a block at a time. Conditional requests (If-None-Match,
+If-Modified-Since), single byte ranges and the .br/.gz variants written by
+core.storage.CompressedManifestStaticFilesStorage are supported.
+"""
+import asyncio
+import json
+import mimetypes
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from wsgiref.headers import Headers
+
+BLOCK_SIZE = 64 * 1024
+# names written by the manifest storage never change content
+IMMUTABLE = 'public, max-age=31536000, immutable'
+MUTABLE = 'public, max-age=60'
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class StaticFile:
+    def __init__(self, path, stat, content_type, cache_control):
+        self.path = path
+        self.size = stat.st_size
+        self.etag = '"%x-%x"' % (int(stat.st_mtime), stat.st_size)
+        self.mtime = int(stat.st_mtime)
+        self.last_modified = formatdate(stat.st_mtime, usegmt=True)
+        self.content_type = content_type
+        self.cache_control = cache_control
+        # encoding -> (path, size, etag)
+        self.variants = {}
+
+
+def build_index(root):
+    """{url path below STATIC_URL: StaticFile} for every file in root."""
+    immutable = set()
+    try:
+        with open(os.path.join(root, 'staticfiles.json')) as manifest:
+            immutable.update(json.load(manifest).get('paths', {}).values())
+    except (OSError, ValueError):
+        pass
+    paths = {}
+    for directory, dirs, files in os.walk(root):
+        for filename in files:
+            path = os.path.join(directory, filename)
+            paths[os.path.relpath(path, root).replace(os.sep, '/')] = path
+    index = {}
+    for name, path in paths.items():
+        if name.endswith(('.br', '.gz')) and name[:-3] in paths:
+            continue
+        content_type, encoding = mimetypes.guess_type(name)
+        content_type = content_type or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type in (
+                'application/javascript', 'application/json', 'image/svg+xml'):
+            content_type += '; charset=utf-8'
+        static_file = index[name] = StaticFile(
+            path, os.stat(path), content_type, IMMUTABLE if name in immutable else MUTABLE)
+        for encoding, extension in ENCODINGS:
+            variant = paths.get(name + extension)
+            if variant is not None:
+                static_file.variants[encoding] = (
+                    variant, os.stat(variant).st_size,
+                    static_file.etag[:-1] + '-%s"' % encoding)
+    return index
+
+
+def accepted_encodings(header):
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = params.strip()
+        if quality.startswith('q='):
+            try:
+                if float(quality[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+class FileRange:
+    """
+    A WSGI response body reading (part of) a file a block at a time. The
+    blocks are bytes the server may hold on to after close().
+    """
+
+    def __init__(self, path, start, length):
+        self.file = open(path, 'rb')
+        self.start = start
+        self.end = start + length
+
+    def __iter__(self):
+        self.file.seek(self.start)
+        remaining = self.end - self.start
+        while remaining > 0:
+            block = self.file.read(min(BLOCK_SIZE, remaining))
+            if not block:
+                return
+            remaining -= len(block)
+            yield block
+
+    def close(self):
+        self.file.close()
+
+
+class StaticFilesHandler:
+    """WSGI middleware answering requests below prefix from the index of root."""
+
+    def __init__(self, application, root, prefix):
+        self.application = application
+        self.prefix = '/' + prefix.strip('/') + '/'
+        self.index = build_index(root) if os.path.isdir(root) else {}
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if not path.startswith(self.prefix):
+            return self.application(environ, start_response)
+        static_file = self.index.get(path[len(self.prefix):])
+        if static_file is None:
+            return self.respond(start_response, '404 Not Found')
+        if environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+            return self.respond(start_response, '405 Method Not Allowed', [('Allow', 'GET, HEAD')])
+        return self.serve(environ, start_response, static_file)
+
+    def respond(self, start_response, status, headers=(), body=b''):
+        start_response(status, [('Content-Type', 'text/plain'),
+                                ('Content-Length', str(len(body)))] + list(headers))
+        return [body]
+
+    def serve(self, environ, start_response, static_file):
+        headers = Headers([
+            ('Content-Type', static_file.content_type),
+            ('Cache-Control', static_file.cache_control),
+            ('Last-Modified', static_file.last_modified),
+            ('Accept-Ranges', 'bytes'),
+        ])
+        if static_file.variants:
+            headers['Vary'] = 'Accept-Encoding'
+        path, size, etag = static_file.path, static_file.size, static_file.etag
+        range_header = environ.get('HTTP_RANGE')
+        if not range_header:
+            # ranges are only served from the uncompressed file
+            accepted = accepted_encodings(environ.get('HTTP_ACCEPT_ENCODING', ''))
+            for encoding, _ in ENCODINGS:
+                if encoding in accepted and encoding in static_file.variants:
+                    path, size, etag = static_file.variants[encoding]
+                    headers['Content-Encoding'] = encoding
+                    break
+        headers['ETag'] = etag
+
+        if self.not_modified(environ, static_file, etag):
+            del headers['Content-Type']
+            start_response('304 Not Modified', headers.items())
+            return []
+
+        start, length, status = 0, size, '200 OK'
+        if range_header and environ.get('HTTP_IF_RANGE', etag) in (etag, static_file.last_modified):
+            byte_range = self.parse_range(range_header, size)
+            if byte_range is None:
+                return self.respond(start_response, '416 Range Not Satisfiable',
+                                    [('Content-Range', 'bytes */%d' % size)])
+            if byte_range:
+                start, end = byte_range
+                length = end - start + 1
+                status = '206 Partial Content'
+                headers['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+        headers['Content-Length'] = str(length)
+        start_response(status, headers.items())
+        if environ['REQUEST_METHOD'] == 'HEAD' or length == 0:
+            return []
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None and length == size:
+            # zero-copy sendfile() where the server supports it
+            return file_wrapper(open(path, 'rb'), BLOCK_SIZE)
+        return FileRange(path, start, length)
+
+    def not_modified(self, environ, static_file, etag):
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return '*' in tags or etag in tags or 'W/' + etag in tags
+        if_modified_since = environ.get('HTTP_IF_MODIFIED_SINCE')
+        if if_modified_since:
+            try:
+                return static_file.mtime <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def parse_range(self, header, size):
+        """
+        (start, end) of a single byte range, False to ignore the header
+        (several ranges are answered with the whole file) and None when it
+        can't be satisfied.
+        """
+        match = RANGE.match(header.strip())
+        if not match:
+            return False
+        first, last = match.groups()
+        if not first:
+            if not last:
+                return False
+            # the last N bytes
+            start, end = max(0, size - int(last)), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        if start >= size or start > end:
+            return None
+        return start, end
+
+
+class ASGIStaticFilesHandler:
+    """StaticFilesHandler in front of an ASGI application."""
+
+    def __init__(self, application, root, prefix):
+        self.application = application
+        self.files = StaticFilesHandler(None, root, prefix)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not scope['path'].startswith(self.files.prefix):
+            return await self.application(scope, receive, send)
+        environ = {'REQUEST_METHOD': scope['method'], 'PATH_INFO': scope['path']}
+        for name, value in scope['headers']:
+            environ['HTTP_' + name.decode('latin1').upper().replace('-', '_')] = (
+                value.decode('latin1'))
+        response = {}
+
+        def start_response(status, headers):
+            response.update(status=int(status.split()[0]), headers=[
+                (name.encode('latin1'), value.encode('latin1')) for name, value in headers])
+
+        # opening and reading the file block, so they run off the event loop
+        loop = asyncio.get_running_loop()
+        body = await loop.run_in_executor(None, self.files, environ, start_response)
+        try:
+            await send({'type': 'http.response.start', 'status': response['status'],
+                        'headers': response['headers']})
+            blocks = iter(body)
+            while True:
+                block = await loop.run_in_executor(None, next, blocks, None)
+                if block is None:
+                    break
+                await send({'type': 'http.response.body', 'body': bytes(block),
+                            'more_body': True})
+            await send({'type': 'http.response.body'})
+        finally:
+            getattr(body, 'close', lambda: None)()
@@ -0,0 +1,24 @@
+from django import template
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from core.caching import ITEM_CARD_TIMEOUT, item_card_key
+
+register = template.Library()
+
+
+@register.simple_tag
+def item_cards(items):
+    """
+    The catalog grid cards of items, read from the cache in a single call.
+    Only the cards missing from it are rendered, and stored in one call.
+    """
+    keys = [item_card_key(item) for item in items]
+    cards = cache.get_many(keys)
+    missing = {}
+    for key, item in zip(keys, items):
+        if key not in cards:
+            cards[key] = missing[key] = render_to_string('pages/card.html', {'item': item})
+    if missing:
+        cache.set_many(missing, ITEM_CARD_TIMEOUT)
+    return mark_safe(''.join(cards[key] for key in keys))
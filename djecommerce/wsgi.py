@@ -1,7 +1,12 @@
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'djecommerce.settings')
 
 application = get_wsgi_application()
+
+if settings.SERVE_STATIC_FILES:
+    from djecommerce.static_handler import StaticFilesHandler
+    application = StaticFilesHandler(application, settings.STATIC_ROOT, settings.STATIC_URL)
@@ -0,0 +1,46 @@
+// Order summary: +, - and trash change the cart through the JSON cart API
+// and update the page in place. The plain links still work without it.
+$(function () {
+	var $summery = $("#order-summery");
+	if (!$summery.length) {
+		return;
+	}
+
+	// like Python's str() of a float, as the page is rendered with
+	function price(value) {
+		return Number.isInteger(value) ? value.toFixed(1) : String(value);
+	}
+
+	$summery.on("click", "a[data-api]", function (event) {
+		event.preventDefault();
+		var $row = $(this).closest("tr.cart-line");
+		$.ajax({
+			url: $(this).data("api"),
+			method: "POST",
+			headers: { "X-CSRFToken": $summery.data("csrf") },
+		})
+			.done(function (delta) {
+				if (!delta.item_count) {
+					// back to the empty cart page
+					window.location.reload();
+					return;
+				}
+				if (delta.line) {
+					$row.find(".line-quantity").text(delta.line.quantity);
+					var html = "$" + price(delta.line.final_price);
+					if (delta.line.amount_saved) {
+						html += ' <span class="badge badge-info"> saving $' +
+							price(delta.line.amount_saved) + "</span>";
+					}
+					$row.find(".line-price").html(html);
+				} else {
+					$row.remove();
+				}
+				$("#order-total").text(price(delta.total));
+				$("#cart-count").text(delta.item_count);
+			})
+			.fail(function () {
+				window.location = event.currentTarget.href;
+			});
+	});
+});